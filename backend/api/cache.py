@@ -0,0 +1,207 @@
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'catalog:{}:version'
+CATALOG_CONTENT_KEY = 'catalog:{}:{}'
+CATALOG_CONTENT_TIMEOUT = 60 * 60 * 24
+RECIPE_VERSION_KEY = 'recipe:{}:version'
+RECIPE_FRAGMENT_KEY = 'recipe:{}:{}:{}'
+RECIPE_FRAGMENT_TIMEOUT = 60 * 60
+RESPONSE_CONTENT_KEY = 'response:{}:{}'
+RESPONSE_LOCK_KEY = 'response:{}:{}:lock'
+RESPONSE_LOCK_TIMEOUT = 30
+
+
+def make_etag(content):
+    return f'"{hashlib.md5(content).hexdigest()}"'
+
+
+class CatalogCache:
+    """Version-stamped cache of pre-serialized catalog responses.
+
+    Each catalog (tags, ingredients) has a version stored in the Django
+    cache; bumping it invalidates every copy at once. Rendered bytes are
+    kept both in the Django cache and in process memory, the latter is
+    trusted only while its version matches the shared one. Nothing is
+    cached unless API_CACHE_ENABLED, i.e. unless all workers share the
+    cache backend and so see the bumped version.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = {}
+
+    def get_version(self, name):
+        key = CATALOG_VERSION_KEY.format(name)
+        version = cache.get(key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(key, version, timeout=None):
+                version = cache.get(key, version)
+        return version
+
+    def invalidate(self, name):
+        version = uuid.uuid4().hex
+        cache.set(CATALOG_VERSION_KEY.format(name), version, timeout=None)
+        with self.lock:
+            self.local.pop(name, None)
+        return version
+
+    def get(self, name, build):
+        """Return (content, etag), calling `build()` for bytes on a miss."""
+        if not settings.API_CACHE_ENABLED:
+            content = build()
+            return content, make_etag(content)
+        version = self.get_version(name)
+        with self.lock:
+            local = self.local.get(name)
+        if local is not None and local[0] == version:
+            return local[1]
+        content_key = CATALOG_CONTENT_KEY.format(name, version)
+        entry = cache.get(content_key)
+        if entry is None:
+            content = build()
+            entry = (content, make_etag(content))
+            cache.set(content_key, entry, timeout=CATALOG_CONTENT_TIMEOUT)
+        with self.lock:
+            self.local[name] = (version, entry)
+        return entry
+
+
+catalog_cache = CatalogCache()
+
+
+class RecipeCache:
+    """Per-recipe cache of the user-independent recipe representation.
+
+    Fragments are keyed by recipe id and a per-recipe version;
+    `invalidate` drops the versions of the given recipes, so a fragment
+    rendered from data read before a change can never be served after
+    it. Changes affecting many recipes (tags, ingredients) bump the
+    shared 'recipes' version of the catalog cache instead.
+    """
+
+    def get_versions(self, recipe_ids):
+        keys = {RECIPE_VERSION_KEY.format(pk): pk for pk in recipe_ids}
+        versions = {
+            keys[key]: version
+            for key, version in cache.get_many(keys).items()
+        }
+        missing = {
+            key: uuid.uuid4().hex
+            for key, pk in keys.items() if pk not in versions
+        }
+        if missing:
+            cache.set_many(missing, timeout=None)
+            versions.update(
+                (keys[key], version) for key, version in missing.items()
+            )
+        return versions
+
+    def get_many(self, recipes, build):
+        """Return {id: fragment}, calling `build(recipes)` for the misses.
+        """
+        if not settings.API_CACHE_ENABLED:
+            return build(recipes)
+        shared_version = catalog_cache.get_version('recipes')
+        versions = self.get_versions(recipe.id for recipe in recipes)
+        keys = {
+            recipe.id: RECIPE_FRAGMENT_KEY.format(
+                shared_version, recipe.id, versions[recipe.id],
+            )
+            for recipe in recipes
+        }
+        cached = cache.get_many(keys.values())
+        fragments = {
+            pk: cached[key] for pk, key in keys.items() if key in cached
+        }
+        missing = [recipe for recipe in recipes if recipe.id not in fragments]
+        if missing:
+            built = build(missing)
+            cache.set_many(
+                {keys[pk]: fragment for pk, fragment in built.items()},
+                timeout=RECIPE_FRAGMENT_TIMEOUT,
+            )
+            fragments.update(built)
+        return fragments
+
+    def invalidate(self, recipe_ids):
+        cache.delete_many(
+            [RECIPE_VERSION_KEY.format(pk) for pk in recipe_ids]
+        )
+
+    def invalidate_all(self):
+        catalog_cache.invalidate('recipes')
+
+
+recipe_cache = RecipeCache()
+
+
+class ResponseCache:
+    """Rendered responses with a short TTL and stale-while-revalidate.
+
+    An entry is fresh for `ttl` seconds while the shared version of
+    `name` is unchanged. A stale entry is still served for `stale_ttl`
+    seconds more to every request except the one that takes the lock
+    and renders the response again; after that the entry is dropped.
+    """
+
+    def __init__(self, name, ttl, stale_ttl):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+    @property
+    def cache_control(self):
+        return (f'public, max-age={self.ttl}, '
+                f'stale-while-revalidate={self.stale_ttl}')
+
+    def get(self, key, build):
+        """Return (content, etag), calling `build()` for bytes if needed.
+        """
+        if not settings.API_CACHE_ENABLED:
+            content = build()
+            return content, make_etag(content)
+        version = catalog_cache.get_version(self.name)
+        content_key = RESPONSE_CONTENT_KEY.format(self.name, key)
+        lock_key = RESPONSE_LOCK_KEY.format(self.name, key)
+        entry = cache.get(content_key)
+        now = time.time()
+        locked = False
+        if entry is not None:
+            entry_version, created, content, etag = entry
+            age = now - created
+            if entry_version == version and age < self.ttl:
+                return content, etag
+            if age < self.ttl + self.stale_ttl:
+                locked = cache.add(
+                    lock_key, True, timeout=RESPONSE_LOCK_TIMEOUT,
+                )
+                if not locked:
+                    return content, etag
+        try:
+            content = build()
+            etag = make_etag(content)
+            cache.set(
+                content_key, (version, now, content, etag),
+                timeout=self.ttl + self.stale_ttl,
+            )
+        finally:
+            if locked:
+                cache.delete(lock_key)
+        return content, etag
+
+    def invalidate(self):
+        catalog_cache.invalidate(self.name)
+
+
+recipe_response_cache = ResponseCache(
+    'recipe-responses',
+    settings.RECIPE_RESPONSE_CACHE_TTL,
+    settings.RECIPE_RESPONSE_STALE_TTL,
+)
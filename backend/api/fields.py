@@ -1,8 +1,111 @@
+import binascii
+import uuid
+
 from django.conf import settings
-from drf_extra_fields.fields import Base64ImageField
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+
+BASE64_HEADER = ';base64,'
+# Whitespace is stripped per chunk and the characters past the last
+# full group of 4 are carried over, so wrapped input decodes as well.
+BASE64_CHUNK_SIZE = 64 * 1024
+# Pillow names some camera JPEGs after the multi-picture extension.
+IMAGE_FORMAT_EXTENSIONS = {'mpo': 'jpeg'}
+
+
+class DecodedImageFile(TemporaryUploadedFile):
+
+    def __del__(self):
+        # The storage may have moved the file away already; close() of
+        # TemporaryUploadedFile tolerates that, the tempfile finalizer
+        # does not.
+        self.close()
 
 
 class RelativeImageField(Base64ImageField):
+    """Base64 image decoded in chunks into a temporary file.
+
+    The encoded size is checked before decoding, the decoded bytes go
+    straight to disk and only the image header is read to find out the
+    format and the dimensions, so a large upload is never held in
+    memory twice and decompression bombs are rejected early.
+    """
+    default_error_messages = {
+        'too_large': 'Размер изображения не должен превышать {max_size} байт',
+        'too_many_pixels': ('Изображение не должно содержать более '
+                            '{max_pixels} пикселей'),
+    }
+
+    def decode_to_file(self, data, start):
+        end = len(data)
+        # Trailing whitespace would hide the padding from the count.
+        while end > start and data[end - 1].isspace():
+            end -= 1
+        line_breaks = (
+            data.count('\n', start, end) + data.count('\r', start, end)
+        )
+        padding = data.count('=', max(start, end - 2), end)
+        size = (end - start - line_breaks) * 3 // 4 - padding
+        if size > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+        file = DecodedImageFile(
+            name=str(uuid.uuid4()), content_type=None, size=0, charset=None,
+        )
+        try:
+            pending = ''
+            for position in range(start, len(data), BASE64_CHUNK_SIZE):
+                chunk = pending + ''.join(
+                    data[position:position + BASE64_CHUNK_SIZE].split()
+                )
+                complete = len(chunk) - len(chunk) % 4
+                file.write(binascii.a2b_base64(chunk[:complete]))
+                pending = chunk[complete:]
+            if pending:
+                file.write(binascii.a2b_base64(pending))
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail('invalid_image')
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
+    def inspect_image(self, file):
+        try:
+            # Image.open only parses the header, pixels are not decoded.
+            with Image.open(file.temporary_file_path()) as image:
+                image_format = image.format.lower()
+                image_format = IMAGE_FORMAT_EXTENSIONS.get(
+                    image_format, image_format,
+                )
+                width, height = image.size
+        except (OSError, Image.DecompressionBombError):
+            file.close()
+            self.fail('invalid_image')
+        if width * height > settings.RECIPE_IMAGE_MAX_PIXELS:
+            file.close()
+            self.fail(
+                'too_many_pixels',
+                max_pixels=settings.RECIPE_IMAGE_MAX_PIXELS,
+            )
+        return image_format
+
+    def to_internal_value(self, data):
+        if data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(data, str):
+            self.fail('invalid_image')
+        start = data.find(BASE64_HEADER, 0, 100)
+        start = 0 if start == -1 else start + len(BASE64_HEADER)
+        file = self.decode_to_file(data, start)
+        extension = self.inspect_image(file)
+        if extension not in self.ALLOWED_TYPES:
+            file.close()
+            self.fail('invalid_image')
+        file.name = f'{file.name}.{extension}'
+        # Skip Base64FieldMixin: the data is already a file.
+        return super(Base64FieldMixin, self).to_internal_value(file)
 
     def to_representation(self, path):
         request = self.context.get('request')
@@ -10,3 +113,28 @@ class RelativeImageField(Base64ImageField):
             image_url = f'{settings.MEDIA_URL}{path}'
             return image_url
         return super().to_representation(path)
+
+
+class ImageVariantMixin:
+    """Read-only recipe image that prefers a processed variant.
+
+    Falls back to the original until the variant has been generated.
+    """
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return super().to_representation(
+            getattr(recipe, self.variant) or recipe.image
+        )
+
+
+class RelativeImageVariantField(ImageVariantMixin, RelativeImageField):
+    pass
+
+
+class ImageVariantField(ImageVariantMixin, serializers.ImageField):
+    pass
@@ -1,14 +1,39 @@
-from django_filters.rest_framework import (AllValuesMultipleFilter,
-                                           BooleanFilter, FilterSet,
-                                           NumberFilter)
+from django.conf import settings
+from django.db.models import Exists, OuterRef
+from django_filters.rest_framework import (BooleanFilter, CharFilter,
+                                           FilterSet, NumberFilter)
 from rest_framework import filters
 
-from recipes.models import Recipe
+from recipes.models import Cart, Favorite, Recipe
+from .search import get_ingredient_search, get_recipe_search
 
 
 class IngredientSearchFilter(filters.SearchFilter):
+    """Autocomplete search: prefix matches go before substring matches."""
     search_param = 'name'
 
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term or view.action != 'list':
+            return queryset
+        return get_ingredient_search().search(
+            queryset, term, settings.INGREDIENT_SEARCH_LIMIT,
+        )
+
+
+class RecipeSearchFilter(filters.SearchFilter):
+    """Full-text search ordered by rank unless ?ordering is given."""
+    ordering_param = 'ordering'
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term or view.action != 'list':
+            return queryset
+        queryset = get_recipe_search().search(queryset, term)
+        if self.ordering_param in request.query_params:
+            return queryset
+        return queryset.order_by('-search_rank', '-pub_date', '-id')
+
 
 class RecipeFilter(FilterSet):
     is_favorited = BooleanFilter(
@@ -21,8 +46,8 @@ class RecipeFilter(FilterSet):
         field_name='author__id',
         lookup_expr='exact'
     )
-    tags = AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = CharFilter(
+        method='get_tags',
     )
 
     class Meta:
@@ -34,16 +59,28 @@ class RecipeFilter(FilterSet):
             'tags'
         )
 
+    def filter_user_relation(self, queryset, model, value):
+        if not self.request.user.is_authenticated:
+            return queryset.none()
+        related = Exists(
+            model.objects.filter(user=self.request.user, recipe=OuterRef('pk'))
+        )
+        return queryset.filter(related if value else ~related)
+
     def get_is_favorited(self, queryset, name, value):
-        if self.request.user.is_authenticated:
-            if value:
-                return queryset.filter(favorites__user=self.request.user)
-            return queryset.exclude(favorites__user=self.request.user)
-        return queryset.none()
+        return self.filter_user_relation(queryset, Favorite, value)
 
     def get_is_in_shopping_cart(self, queryset, name, value):
-        if self.request.user.is_authenticated:
-            if value:
-                return queryset.filter(shopping_cart__user=self.request.user)
-            return queryset.exclude(shopping_cart__user=self.request.user)
-        return queryset.none()
+        return self.filter_user_relation(queryset, Cart, value)
+
+    def get_tags(self, queryset, name, value):
+        # EXISTS instead of a join keeps recipes with several of the
+        # requested tags from being duplicated, so no DISTINCT is needed.
+        return queryset.filter(
+            Exists(
+                Recipe.tags.through.objects.filter(
+                    recipe_id=OuterRef('pk'),
+                    tag__slug__in=self.data.getlist(name),
+                )
+            )
+        )
@@ -0,0 +1,476 @@
+import base64
+import gc
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from api.pagination import RECIPE_MAX_PAGE_SIZE, TimelinePagination
+from recipes.models import (Cart, Favorite, Follow, Ingredient,
+                            IngredientRecipe, Recipe, ShoppingListItem, Tag,
+                            TimelineEntry)
+
+User = get_user_model()
+
+DEFAULT_BASELINE_PATH = os.path.join(
+    settings.BASE_DIR, 'data', 'benchmark_baseline.json',
+)
+DEFAULT_USERS = 2000
+DEFAULT_RECIPES = 5000
+DEFAULT_REPEAT = 20
+DEFAULT_TOLERANCE = 0.25
+# p95 of a few dozen requests is close to their maximum, which a single
+# scheduler hiccup moves, so it is allowed to grow more than the median.
+DEFAULT_P95_TOLERANCE = 1.0
+# Added to the relative tolerance: timer jitter dominates fast endpoints.
+LATENCY_SLACK_MS = 2
+BATCH_SIZE = 1000
+PANTRY_SIZE = 8
+BULK_SIZE = 10
+SEED = 42
+PASSWORD = 'benchmark-password'
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    },
+}
+
+MSG_SEEDING = 'Seeding benchmark dataset...'
+MSG_SEEDED = 'Seeded {} users, {} recipes, {} ingredients in {:.1f}s.'
+MSG_ROW = '{:<26} {:<6} {:>4} queries  p50 {:>7.1f}ms  p95 {:>7.1f}ms'
+MSG_BASELINE_SAVED = 'Baseline saved to {}'
+MSG_PASSED = 'All endpoints are within the baseline.'
+
+ERR_QUERIES = '{}: {} queries, baseline allows {}'
+ERR_LATENCY = ('{}: {} {:.1f}ms, baseline {:.1f}ms '
+               f'(+{{:.0%}} +{LATENCY_SLACK_MS}ms allowed)')
+ERR_NO_BASELINE = ('{}: no {} in the baseline, run with --update-baseline '
+                   'or pass --queries-only')
+ERR_STATUS = '{}: unexpected status {} (expected {})'
+ERR_REGRESSIONS = 'Benchmark regressions detected:\n{}'
+
+
+class Command(BaseCommand):
+    help = ("This command seeds a realistic dataset in a test database, "
+            "measures query count and latency of every API endpoint and "
+            "compares them with the stored baseline")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=DEFAULT_USERS,
+                            help='number of users to seed.')
+        parser.add_argument('--recipes', type=int, default=DEFAULT_RECIPES,
+                            help='number of recipes to seed.')
+        parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                            help='number of requests per endpoint.')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH,
+                            help='path to the baseline JSON file.')
+        parser.add_argument('--tolerance', type=float,
+                            default=DEFAULT_TOLERANCE,
+                            help='allowed relative p50 latency growth.')
+        parser.add_argument('--p95-tolerance', type=float,
+                            default=DEFAULT_P95_TOLERANCE,
+                            help='allowed relative p95 latency growth.')
+        parser.add_argument('--queries-only', action='store_true',
+                            help='compare query counts only, for machines '
+                                 'the baseline latency was not measured on.')
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='store the current results as baseline.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='keep the test database between runs.')
+
+    def handle(self, *args, **options):
+        runner = DiscoverRunner(verbosity=0, keepdb=options['keepdb'])
+        old_config = runner.setup_databases()
+        media_root = tempfile.mkdtemp()
+        try:
+            # A private cache, so that cached fragments of the test
+            # database never mix with the real ones, and a private media
+            # root for the uploaded images. Timeline fan-out and image
+            # variants run inline, so their queries are counted.
+            with override_settings(ALLOWED_HOSTS=['testserver'],
+                                   CACHES=BENCHMARK_CACHES,
+                                   MEDIA_ROOT=media_root,
+                                   RECIPE_IMAGE_WORKERS=0,
+                                   TIMELINE_WORKERS=0):
+                self.seed(options['users'], options['recipes'])
+                # With DEBUG the seeding queries can fill the query log,
+                # which CaptureQueriesContext needs room in.
+                reset_queries()
+                results = self.measure(options['repeat'])
+        finally:
+            runner.teardown_databases(old_config)
+            shutil.rmtree(media_root, ignore_errors=True)
+        if options['update_baseline']:
+            self.save_baseline(options['baseline'], results)
+            return
+        self.compare(
+            options['baseline'], results,
+            {'p50_ms': options['tolerance'],
+             'p95_ms': options['p95_tolerance']},
+            options['queries_only'],
+        )
+
+    def seed(self, users_count, recipes_count):
+        self.stdout.write(self.style.NOTICE(MSG_SEEDING))
+        started = time.perf_counter()
+        rnd = random.Random(SEED)
+        call_command('load_ingredients', stdout=io.StringIO())
+        call_command('load_tags', stdout=io.StringIO())
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'user{number}',
+                    email=f'user{number}@foodgram.local',
+                    first_name=f'Имя{number}',
+                    last_name=f'Фамилия{number}',
+                    password=password,
+                )
+                for number in range(users_count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=rnd.choice(user_ids),
+                    name=f'Рецепт {number}',
+                    text='Описание способа приготовления блюда',
+                    image='recipes/images/benchmark.png',
+                    cooking_time=rnd.randint(5, 120),
+                )
+                for number in range(recipes_count)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in rnd.sample(tag_ids, rnd.randint(1, 2))
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rnd.randint(1, 500),
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in rnd.sample(
+                    ingredient_ids, rnd.randint(3, 12),
+                )
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        for model, per_user in ((Favorite, 15), (Cart, 5)):
+            model.objects.bulk_create(
+                (
+                    model(user_id=user_id, recipe_id=recipe_id)
+                    for user_id in user_ids
+                    for recipe_id in rnd.sample(recipe_ids, per_user)
+                ),
+                batch_size=BATCH_SIZE,
+            )
+        Recipe.objects.recount_counters()
+        Recipe.objects.update_search_vectors()
+        call_command('update_recipe_neighbors', all=True,
+                     stdout=io.StringIO())
+        ShoppingListItem.objects.rebuild()
+        Follow.objects.bulk_create(
+            (
+                Follow(user_id=user_id, following_id=following_id)
+                for user_id in user_ids
+                for following_id in rnd.sample(user_ids, 10)
+                if following_id != user_id
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        call_command('fan_out_timelines', stdout=io.StringIO())
+        self.stdout.write(self.style.SUCCESS(MSG_SEEDED.format(
+            len(user_ids), len(recipe_ids), len(ingredient_ids),
+            time.perf_counter() - started,
+        )))
+
+    def get_scenarios(self):
+        """Return the benchmark user and the scenario phases.
+
+        A scenario is (name, method, url, auth, status[, json body]); the
+        url and the body may be callables taking the iteration state.
+        Each phase runs `repeat` times before the next one, so the recipe
+        and user writes, which invalidate the cached recipe responses,
+        come after the reads were measured.
+        """
+        user = User.objects.filter(follower__isnull=False).first()
+        other = User.objects.exclude(
+            following__user=user,
+        ).exclude(pk=user.pk).first()
+        recipe_ids = list(Recipe.objects.exclude(favorites__user=user).exclude(
+            shopping_cart__user=user,
+        ).values_list('id', flat=True)[:BULK_SIZE])
+        recipe = Recipe.objects.get(pk=recipe_ids[0])
+        bulk = {'recipes': recipe_ids}
+        tag = Tag.objects.first()
+        ingredient = Ingredient.objects.first()
+        pantry = '&'.join(
+            f'ingredients={ingredient_id}'
+            for ingredient_id in recipe.ingredients.values_list(
+                'id', flat=True,
+            )[:PANTRY_SIZE]
+        )
+        timeline_cursor = TimelinePagination().encode_cursor([str(
+            TimelineEntry.objects.filter(user=user).order_by(
+                '-recipe_id',
+            ).values_list('recipe_id', flat=True)[RECIPE_MAX_PAGE_SIZE]
+        )])
+        recipe_body = {
+            'name': 'Рецепт для замера',
+            'text': 'Описание способа приготовления блюда',
+            'cooking_time': 30,
+            'image': self.make_image(),
+            'tags': [tag.id],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': 100}
+                for ingredient_id in recipe.ingredients.values_list(
+                    'id', flat=True,
+                )
+            ],
+        }
+        update_body = dict(
+            recipe_body,
+            cooking_time=45,
+            ingredients=[
+                dict(item, amount=200) for item in recipe_body['ingredients']
+            ],
+        )
+        del update_body['image']
+
+        def created_url(state):
+            return f'/api/recipes/{state["created"]}/'
+
+        def registration(state):
+            return {
+                'email': f'newcomer{state["iteration"]}@foodgram.local',
+                'username': f'newcomer{state["iteration"]}',
+                'first_name': 'Новый',
+                'last_name': 'Пользователь',
+                'password': PASSWORD,
+            }
+
+        reads = (
+            ('users-list', 'get', '/api/users/', False, 200),
+            ('users-detail', 'get', f'/api/users/{other.id}/', True, 200),
+            ('users-me', 'get', '/api/users/me/', True, 200),
+            ('users-subscriptions', 'get',
+             '/api/users/subscriptions/?recipes_limit=3', True, 200),
+            ('users-subscriptions-cursor', 'get',
+             '/api/users/subscriptions/?cursor=&recipes_limit=3', True, 200),
+            ('users-subscribe', 'post',
+             f'/api/users/{other.id}/subscribe/', True, 201),
+            ('users-unsubscribe', 'delete',
+             f'/api/users/{other.id}/subscribe/', True, 204),
+            ('users-timeline', 'get', '/api/users/timeline/', True, 200),
+            ('users-timeline-next', 'get',
+             f'/api/users/timeline/?cursor={timeline_cursor}', True, 200),
+            ('auth-token-login', 'post', '/api/auth/token/login/', False,
+             200, {'email': user.email, 'password': PASSWORD}),
+            ('auth-token-logout', 'post', '/api/auth/token/logout/', True,
+             204),
+            ('tags-list', 'get', '/api/tags/', False, 200),
+            ('tags-detail', 'get', f'/api/tags/{tag.id}/', False, 200),
+            ('ingredients-list', 'get', '/api/ingredients/', False, 200),
+            ('ingredients-search', 'get',
+             '/api/ingredients/?name=сах', False, 200),
+            ('ingredients-detail', 'get',
+             f'/api/ingredients/{ingredient.id}/', False, 200),
+            ('recipes-list-anonymous', 'get', '/api/recipes/', False, 200),
+            ('recipes-list', 'get', '/api/recipes/', True, 200),
+            ('recipes-list-cursor', 'get', '/api/recipes/?cursor=', True,
+             200),
+            ('recipes-list-filtered', 'get',
+             f'/api/recipes/?tags={tag.slug}&is_favorited=1', True, 200),
+            ('recipes-list-popular', 'get',
+             '/api/recipes/?ordering=-favorites_count', True, 200),
+            ('recipes-list-search', 'get',
+             '/api/recipes/?search=сахар', True, 200),
+            ('recipes-list-author', 'get',
+             f'/api/recipes/?author={other.id}', True, 200),
+            ('recipes-detail', 'get', f'/api/recipes/{recipe.id}/', True,
+             200),
+            ('recipes-pantry', 'get', f'/api/recipes/pantry/?{pantry}',
+             True, 200),
+            ('recipes-similar', 'get', f'/api/recipes/{recipe.id}/similar/',
+             True, 200),
+            ('recipes-favorite', 'post',
+             f'/api/recipes/{recipe.id}/favorite/', True, 201),
+            ('recipes-unfavorite', 'delete',
+             f'/api/recipes/{recipe.id}/favorite/', True, 204),
+            ('recipes-cart-add', 'post',
+             f'/api/recipes/{recipe.id}/shopping_cart/', True, 201),
+            ('recipes-cart-remove', 'delete',
+             f'/api/recipes/{recipe.id}/shopping_cart/', True, 204),
+            ('recipes-favorite-bulk', 'post', '/api/recipes/favorite/',
+             True, 201, bulk),
+            ('recipes-unfavorite-bulk', 'delete', '/api/recipes/favorite/',
+             True, 204, bulk),
+            ('recipes-cart-add-bulk', 'post', '/api/recipes/shopping_cart/',
+             True, 201, bulk),
+            ('recipes-cart-remove-bulk', 'delete',
+             '/api/recipes/shopping_cart/', True, 204, bulk),
+            ('recipes-download-cart', 'get',
+             '/api/recipes/download_shopping_cart/', True, 200),
+        )
+        writes = (
+            ('recipes-create', 'post', '/api/recipes/', True, 201,
+             recipe_body),
+            ('recipes-update', 'patch', created_url, True, 200, update_body),
+            ('recipes-delete', 'delete', created_url, True, 204),
+            ('users-create', 'post', '/api/users/', False, 201,
+             registration),
+            ('users-set-password', 'post', '/api/users/set_password/', True,
+             204, {'current_password': PASSWORD, 'new_password': PASSWORD}),
+        )
+        return user, (reads, writes)
+
+    @staticmethod
+    def make_image():
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), 'orange').save(buffer, 'PNG')
+        encoded = base64.b64encode(buffer.getvalue()).decode()
+        return f'data:image/png;base64,{encoded}'
+
+    def request(self, client, method, url, data=None):
+        if data is None:
+            response = getattr(client, method)(url)
+        else:
+            response = getattr(client, method)(url, data, format='json')
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, repeat):
+        user, phases = self.get_scenarios()
+        scenarios = [scenario for phase in phases for scenario in phase]
+        anonymous = APIClient()
+        authenticated = APIClient()
+        authenticated.force_authenticate(user)
+        timings = {name: [] for name, *_ in scenarios}
+        queries = {}
+        errors = []
+        for phase in phases:
+            for iteration in range(repeat):
+                # Write scenarios come in create/delete pairs, so every
+                # iteration starts from the same database state (except
+                # for the registered users).
+                state = {'iteration': iteration, 'created': None}
+                for name, method, url, auth, expected, *data in phase:
+                    client = authenticated if auth else anonymous
+                    url = url(state) if callable(url) else url
+                    data = [
+                        value(state) if callable(value) else value
+                        for value in data
+                    ]
+                    # As timeit does, keep collector pauses out of the
+                    # timings: they land on random requests.
+                    gc.collect()
+                    gc.disable()
+                    try:
+                        with CaptureQueriesContext(connection) as context:
+                            started = time.perf_counter()
+                            response = self.request(
+                                client, method, url, *data,
+                            )
+                            timings[name].append(
+                                time.perf_counter() - started,
+                            )
+                    finally:
+                        gc.enable()
+                    if response.status_code != expected:
+                        errors.append(ERR_STATUS.format(
+                            name, response.status_code, expected,
+                        ))
+                    if response.status_code == 201 and 'id' in getattr(
+                        response, 'data', {},
+                    ):
+                        state['created'] = response.data['id']
+                    queries[name] = max(queries.get(name, 0), len(context))
+        if errors:
+            raise CommandError(ERR_REGRESSIONS.format(
+                '\n'.join(sorted(set(errors)))
+            ))
+        results = {}
+        for name, method, *_ in scenarios:
+            samples = sorted(timing * 1000 for timing in timings[name])
+            if len(samples) > 1:
+                percentiles = statistics.quantiles(samples, n=20)
+                p50, p95 = statistics.median(samples), percentiles[-1]
+            else:
+                p50 = p95 = samples[0]
+            results[name] = {
+                'queries': queries[name],
+                'p50_ms': round(p50, 2),
+                'p95_ms': round(p95, 2),
+            }
+            self.stdout.write(MSG_ROW.format(
+                name, method.upper(), queries[name], p50, p95,
+            ))
+        return results
+
+    def save_baseline(self, path, results):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+            file.write('\n')
+        self.stdout.write(self.style.SUCCESS(MSG_BASELINE_SAVED.format(path)))
+
+    def compare(self, path, results, tolerances, queries_only=False):
+        with open(path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if expected is None:
+                regressions.append(ERR_NO_BASELINE.format(name, 'entry'))
+                continue
+            if result['queries'] > expected['queries']:
+                regressions.append(ERR_QUERIES.format(
+                    name, result['queries'], expected['queries'],
+                ))
+            # Latency depends on the machine the baseline was measured
+            # on; --queries-only skips it elsewhere.
+            if queries_only:
+                continue
+            for metric, tolerance in tolerances.items():
+                if metric not in expected:
+                    regressions.append(ERR_NO_BASELINE.format(name, metric))
+                elif result[metric] > (
+                    expected[metric] * (1 + tolerance) + LATENCY_SLACK_MS
+                ):
+                    regressions.append(ERR_LATENCY.format(
+                        name, metric[:3], result[metric], expected[metric],
+                        tolerance,
+                    ))
+        if regressions:
+            raise CommandError(ERR_REGRESSIONS.format('\n'.join(regressions)))
+        self.stdout.write(self.style.SUCCESS(MSG_PASSED))
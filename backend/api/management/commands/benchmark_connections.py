@@ -0,0 +1,85 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import override_settings
+
+from core.db import describe_connection_strategy
+from core.loadtest import get_wsgi_handler, wsgi_get
+
+DEFAULT_URL = '/api/users/'
+DEFAULT_REQUESTS = 500
+DEFAULT_THREADS = 4
+
+MSG_STRATEGY = '{:<24} {:>8.1f} req/s  ({} requests, {} threads, {:.2f}s)'
+MSG_ERRORS = '{}: {} requests failed'
+
+
+class Command(BaseCommand):
+    help = ("This command measures requests per second of an endpoint "
+            "with connections opened per request and with persistent "
+            "connections, using the configured database")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default=DEFAULT_URL,
+                            help='GET endpoint to request.')
+        parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS,
+                            help='requests per strategy.')
+        parser.add_argument('--threads', type=int, default=DEFAULT_THREADS,
+                            help='concurrent client threads.')
+
+    def run(self, url, requests_count, threads_count):
+        errors = []
+        per_thread = requests_count // threads_count
+
+        handler = get_wsgi_handler()
+
+        def worker():
+            for _ in range(per_thread):
+                if wsgi_get(handler, url) != 200:
+                    errors.append(url)
+            connections.close_all()
+
+        threads = [
+            threading.Thread(target=worker) for _ in range(threads_count)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return per_thread * threads_count, time.perf_counter() - started, (
+            len(errors)
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(describe_connection_strategy())
+        database = connections['default'].settings_dict
+        configured_max_age = database['CONN_MAX_AGE']
+        # With the pool engine both runs reuse pooled connections.
+        strategies = (
+            ('per-request', 0),
+            ('persistent', configured_max_age or settings.DB_CONN_MAX_AGE),
+        )
+        connections.close_all()
+        try:
+            for name, max_age in strategies:
+                # Wrappers share this dict and read it on connect.
+                database['CONN_MAX_AGE'] = max_age
+                with override_settings(ALLOWED_HOSTS=['testserver']):
+                    count, elapsed, errors = self.run(
+                        options['url'], options['requests'],
+                        options['threads'],
+                    )
+                self.stdout.write(MSG_STRATEGY.format(
+                    f'{name} (max age {max_age})', count / elapsed,
+                    count, options['threads'], elapsed,
+                ))
+                if errors:
+                    self.stdout.write(self.style.WARNING(
+                        MSG_ERRORS.format(name, errors)
+                    ))
+        finally:
+            database['CONN_MAX_AGE'] = configured_max_age
@@ -0,0 +1,86 @@
+import itertools
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.http import QueryDict
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+from api.filters import RecipeFilter
+from api.pagination import RECIPE_MAX_PAGE_SIZE
+from recipes.models import Recipe, Tag
+
+User = get_user_model()
+
+MSG_HEADER = '=== {}'
+MSG_NO_FILTERS = '(no filters)'
+
+ERR_NO_USER = 'There are no users to run the filters for.'
+
+
+class Command(BaseCommand):
+    help = ("This command prints the query plan of every RecipeFilter "
+            "combination (EXPLAIN ANALYZE on PostgreSQL)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int,
+                            help='id of the user the filters run for.')
+        parser.add_argument('--author', type=int,
+                            help='author id for the author filter.')
+        parser.add_argument('--tags', nargs='+',
+                            help='tag slugs for the tags filter.')
+        parser.add_argument('--no-analyze', action='store_true',
+                            help='plan only, do not execute the queries.')
+
+    def get_combinations(self, author_id, tags):
+        choices = (
+            ('is_favorited', (None, '1', '0')),
+            ('is_in_shopping_cart', (None, '1', '0')),
+            ('author', (None, str(author_id))),
+            ('tags', (None, tags)),
+        )
+        names = [name for name, _ in choices]
+        for values in itertools.product(*(values for _, values in choices)):
+            params = QueryDict(mutable=True)
+            for name, value in zip(names, values):
+                if value is None:
+                    continue
+                if isinstance(value, (list, tuple)):
+                    params.setlist(name, value)
+                else:
+                    params[name] = value
+            yield params
+
+    def handle(self, *args, **options):
+        user = (
+            User.objects.filter(pk=options['user']).first()
+            if options['user'] else User.objects.first()
+        )
+        if user is None:
+            raise CommandError(ERR_NO_USER)
+        author_id = options['author'] or Recipe.objects.values_list(
+            'author_id', flat=True,
+        ).first() or user.id
+        tags = options['tags'] or list(
+            Tag.objects.values_list('slug', flat=True)[:2]
+        )
+        explain_options = {}
+        if connection.vendor == 'postgresql':
+            explain_options = {
+                'analyze': not options['no_analyze'],
+                'buffers': not options['no_analyze'],
+            }
+        for params in self.get_combinations(author_id, tags):
+            request = Request(RequestFactory().get('/api/recipes/', params))
+            request.user = user
+            queryset = RecipeFilter(
+                data=params,
+                queryset=Recipe.objects.order_by('-pub_date', '-id'),
+                request=request,
+            ).qs[:RECIPE_MAX_PAGE_SIZE]
+            self.stdout.write(self.style.SUCCESS(
+                MSG_HEADER.format(params.urlencode() or MSG_NO_FILTERS)
+            ))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
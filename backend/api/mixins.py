@@ -1,4 +1,26 @@
+import hashlib
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework import mixins, viewsets
+from rest_framework.renderers import JSONRenderer
+
+from .cache import catalog_cache
+
+
+def make_cached_response(request, content, etag, cache_control):
+    """Build a JSON response from cached bytes, honoring If-None-Match."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (
+        etag in parse_etags(if_none_match) or if_none_match == '*'
+    ):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    return response
 
 
 class RetrieveListViewSet(
@@ -7,3 +29,73 @@ class RetrieveListViewSet(
     viewsets.GenericViewSet
 ):
     pass
+
+
+class CachedCatalogViewSet(RetrieveListViewSet):
+    """Serve the unfiltered list from the catalog cache with an ETag.
+
+    Requests with query parameters (e.g. ingredient search) or asking
+    for a non-JSON format go through the regular list.
+    """
+    catalog_name = None
+
+    def render_catalog(self):
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return JSONRenderer().render(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+        content, etag = catalog_cache.get(
+            self.catalog_name, self.render_catalog,
+        )
+        return make_cached_response(
+            request, content, etag, 'public, no-cache',
+        )
+
+
+class AnonymousResponseCacheMixin:
+    """Serve list and retrieve to anonymous users from `response_cache`.
+
+    Anonymous responses depend only on the path and the query, so they
+    are cached by those, with the parameters and their values sorted.
+    Requests with parameters outside `cached_query_params` are not
+    cached.
+    """
+    response_cache = None
+    cached_query_params = ()
+
+    def get_response_cache_key(self, request):
+        params = request.query_params
+        if (
+            request.user.is_authenticated
+            or request.accepted_renderer.format != 'json'
+            or any(name not in self.cached_query_params for name in params)
+        ):
+            return None
+        query = sorted((name, sorted(params.getlist(name))) for name in params)
+        return hashlib.md5(
+            f'{request.get_host()}{request.path}{query}'.encode()
+        ).hexdigest()
+
+    def serve_cached(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+        content, etag = self.response_cache.get(
+            key,
+            lambda: JSONRenderer().render(
+                handler(request, *args, **kwargs).data
+            ),
+        )
+        response = make_cached_response(
+            request, content, etag, self.response_cache.cache_control,
+        )
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.serve_cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.serve_cached(super().retrieve, request, *args, **kwargs)
@@ -1,17 +1,261 @@
-from rest_framework.pagination import (LimitOffsetPagination,
+import hashlib
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, LimitOffsetPagination,
                                        PageNumberPagination)
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 RECIPE_MAX_PAGE_SIZE = 6
 USER_MAX_PAGE_SIZE = 10
 USER_PAGINATION_DEFAULT_LIMIT = 10
+MAX_CURSOR_PAGE_SIZE = 100
+COUNT_CACHE_KEY = 'pagination:count:{}'
+
+ERR_INVALID_CURSOR = 'Неверный курсор'
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that can avoid an exact COUNT(*).
+
+    With PAGINATION_COUNT_MODE = 'estimate' an unfiltered queryset is
+    counted from the planner statistics (pg_class.reltuples) and any
+    other queryset from a count cached for PAGINATION_COUNT_CACHE_TTL.
+    """
+
+    @cached_property
+    def count(self):
+        if settings.PAGINATION_COUNT_MODE != 'estimate':
+            return super().count
+        query = self.object_list.query
+        if connection.vendor == 'postgresql' and not query.where.children:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE oid = %s::regclass',
+                    (self.object_list.model._meta.db_table,),
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 (or 0) until the table is first analyzed.
+            if row and row[0] > 0:
+                return row[0]
+        sql, params = query.sql_with_params()
+        key = COUNT_CACHE_KEY.format(
+            hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        )
+        return cache.get_or_set(
+            key, lambda: super(EstimatedCountPaginator, self).count,
+            settings.PAGINATION_COUNT_CACHE_TTL,
+        )
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only cursor pagination over a composite ordering.
+
+    The cursor stores the ordering values of the last returned row, and
+    the next page is fetched with a row comparison on those values, so
+    there is neither COUNT(*) nor OFFSET. The ordering must end with a
+    unique field and be backed by an index.
+    """
+    ordering = ('-id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = RECIPE_MAX_PAGE_SIZE
+    max_page_size = MAX_CURSOR_PAGE_SIZE
+    invalid_cursor_message = ERR_INVALID_CURSOR
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(b64decode(encoded.encode()).decode())
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or (
+            len(position) != len(self.ordering)
+        ):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def coerce_position(self, model, position):
+        """Convert the cursor values with the model fields they belong to.
+        """
+        try:
+            return [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, position)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, position):
+        return b64encode(json.dumps(position).encode()).decode()
+
+    def get_position_filter(self, position):
+        """Build (a < x) OR (a = x AND b < y) ... for the ordering."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            position = self.coerce_position(queryset.model, position)
+            queryset = queryset.filter(self.get_position_filter(position))
+        page = list(queryset[:page_size + 1])
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.next_position = None
+        if self.has_next:
+            last = page[-1]
+            self.next_position = [
+                str(getattr(last, field.lstrip('-')))
+                for field in self.ordering
+            ]
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data),
+        )))
+
+
+class RecipeCursorPagination(KeysetPagination):
+    ordering = ('-pub_date', '-id')
+    page_size = RECIPE_MAX_PAGE_SIZE
+
+
+class UserCursorPagination(KeysetPagination):
+    ordering = ('id',)
+    page_size = USER_MAX_PAGE_SIZE
+
+
+class TimelinePagination(KeysetPagination):
+    """Keyset pagination of recipes merged from several id sources.
+
+    `paginate_queryset` also takes `sources`, (recipe id field,
+    queryset) pairs; each one is filtered below the cursor and sliced on
+    its own, so every source is served by its own index, and the merged
+    ids are loaded from the recipe queryset.
+    """
+    ordering = ('-id',)
+    page_size = RECIPE_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None, sources=()):
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+        if position is not None:
+            position = self.coerce_position(queryset.model, position)
+        recipe_ids = set()
+        for field, source in sources:
+            source = source.order_by(f'-{field}')
+            if position is not None:
+                source = source.filter(**{f'{field}__lt': position[0]})
+            recipe_ids.update(
+                source.values_list(field, flat=True)[:page_size + 1]
+            )
+        recipe_ids = sorted(recipe_ids, reverse=True)[:page_size + 1]
+        self.has_next = len(recipe_ids) > page_size
+        recipe_ids = recipe_ids[:page_size]
+        recipes = queryset.in_bulk(recipe_ids)
+        page = [
+            recipes[recipe_id] for recipe_id in recipe_ids
+            if recipe_id in recipes
+        ]
+        self.next_position = (
+            [str(recipe_ids[-1])] if self.has_next else None
+        )
+        return page
+
+
+class OptInCursorPaginationMixin:
+    """Switch to `cursor_pagination_class` when ?cursor is passed.
+
+    An empty ?cursor= requests the first page in cursor mode. The cursor
+    can only continue the keyset ordering, so a queryset sorted another
+    way (?ordering, ?search rank) is paginated by page number instead,
+    on the first page and on every page its links lead to.
+    """
+    cursor_pagination_class = None
+    cursor_paginator = None
+
+    def use_cursor(self, queryset, request):
+        cursor_class = self.cursor_pagination_class
+        if cursor_class.cursor_query_param not in request.query_params:
+            return False
+        order_by = tuple(queryset.query.order_by)
+        return order_by == cursor_class.ordering[:len(order_by)]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(queryset, request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view,
+            )
+        self.cursor_paginator = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class RecipePagination(OptInCursorPaginationMixin, PageNumberPagination):
+    django_paginator_class = EstimatedCountPaginator
+    cursor_pagination_class = RecipeCursorPagination
+    page_size_query_param = 'limit'
+    page_size = RECIPE_MAX_PAGE_SIZE
 
 
-class RecipePagination(PageNumberPagination):
+class PantryPagination(PageNumberPagination):
+    """Pages over the ranked matches of the in-memory pantry index."""
     page_size_query_param = 'limit'
     page_size = RECIPE_MAX_PAGE_SIZE
 
 
-class UserPagination(PageNumberPagination, LimitOffsetPagination):
+class UserPagination(OptInCursorPaginationMixin, PageNumberPagination,
+                     LimitOffsetPagination):
+    django_paginator_class = EstimatedCountPaginator
+    cursor_pagination_class = UserCursorPagination
     page_size_query_param = 'limit'
     default_limit = USER_PAGINATION_DEFAULT_LIMIT
     page_size = USER_MAX_PAGE_SIZE
@@ -0,0 +1,243 @@
+import bisect
+import heapq
+import threading
+import time
+from array import array
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from core.workers import BackgroundPool
+from recipes.models import IngredientRecipe
+
+from .cache import catalog_cache
+
+PANTRY_CATALOG = 'pantry'
+# Below len(posting) / PROBE_FACTOR candidates, binary searches in a
+# long posting are cheaper than turning it into a set.
+PROBE_FACTOR = 16
+
+index_pool = BackgroundPool('pantry-index', 'RECIPE_PANTRY_INDEX_WORKERS')
+
+
+class PantryIndex:
+    """Inverted index for pantry matching, kept in process memory.
+
+    `postings` maps an ingredient id to the sorted array of ids of the
+    recipes that use it, `totals` maps a recipe id to its number of
+    ingredients. A pantry query merges the postings of its ingredients
+    into per-recipe match counts and ranks the recipes by the share of
+    their ingredients the pantry covers, so no query hits the database.
+
+    Writes made by this process are applied incrementally (`update`)
+    and bump the shared 'pantry' catalog version, so other processes
+    notice them on their next query. A stale index (other version or
+    older than the TTL) keeps serving while a new one is built in the
+    background and swapped in; only the first build blocks a request.
+    """
+
+    def __init__(self, ttl, max_results, max_candidates):
+        self.ttl = ttl
+        self.max_results = max_results
+        self.max_candidates = max_candidates
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+        self.postings = None
+        self.totals = None
+        self.version = None
+        self.built_at = 0
+        self.rebuilding = False
+        # Changes made while a build runs, replayed onto its result,
+        # and the version the result will have.
+        self.pending = None
+        self.pending_version = None
+
+    @staticmethod
+    def get_version():
+        # Versions are only shared if all workers share the cache.
+        if not settings.API_CACHE_ENABLED:
+            return None
+        return catalog_cache.get_version(PANTRY_CATALOG)
+
+    def publish(self):
+        """Bump the shared version after a change made by this process.
+
+        The index keeps the new version, so this process does not
+        rebuild for its own change, unless it had already missed one.
+        """
+        if not settings.API_CACHE_ENABLED:
+            return
+        current = catalog_cache.get_version(PANTRY_CATALOG)
+        version = catalog_cache.invalidate(PANTRY_CATALOG)
+        with self.lock:
+            if self.version == current:
+                self.version = version
+            if self.pending is not None and self.pending_version == current:
+                self.pending_version = version
+
+    def invalidate(self):
+        catalog_cache.invalidate(PANTRY_CATALOG)
+        with self.lock:
+            self.built_at = 0
+
+    def build(self):
+        postings, totals = {}, Counter()
+        # The (ingredient, recipe) unique index returns the rows sorted.
+        rows = IngredientRecipe.objects.filter(
+            recipe__isnull=False,
+        ).order_by('ingredient_id', 'recipe_id').values_list(
+            'ingredient_id', 'recipe_id',
+        )
+        for ingredient_id, recipe_id in rows.iterator():
+            posting = postings.get(ingredient_id)
+            if posting is None:
+                posting = postings[ingredient_id] = array('q')
+            posting.append(recipe_id)
+            totals[recipe_id] += 1
+        return postings, totals
+
+    def rebuild(self, version):
+        with self.lock:
+            self.pending, self.pending_version = [], version
+        try:
+            postings, totals = self.build()
+            with self.lock:
+                for change in self.pending:
+                    self.apply(postings, totals, *change)
+                self.postings, self.totals = postings, totals
+                self.version = self.pending_version
+                self.built_at = time.monotonic()
+        finally:
+            with self.lock:
+                self.pending = None
+                self.rebuilding = False
+
+    def ensure_built(self):
+        version = self.get_version()
+        if self.postings is None:
+            with self.build_lock:
+                if self.postings is None:
+                    self.rebuild(version)
+            return
+        with self.lock:
+            expired = time.monotonic() - self.built_at > self.ttl
+            if self.rebuilding or not (expired or version != self.version):
+                return
+            self.rebuilding = True
+        index_pool.submit(self.rebuild, version)
+
+    @staticmethod
+    def find(posting, recipe_id):
+        position = bisect.bisect_left(posting, recipe_id)
+        found = position < len(posting) and posting[position] == recipe_id
+        return position, found
+
+    @classmethod
+    def apply(cls, postings, totals, recipe_id, added, removed):
+        # Postings are replaced, never changed in place: `match` reads
+        # the arrays it took under the lock after releasing it.
+        for ingredient_id in removed:
+            posting = postings.get(ingredient_id, ())
+            position, found = cls.find(posting, recipe_id)
+            if not found:
+                continue
+            postings[ingredient_id] = (
+                posting[:position] + posting[position + 1:]
+            )
+            totals[recipe_id] -= 1
+            if totals[recipe_id] <= 0:
+                del totals[recipe_id]
+        for ingredient_id in added:
+            posting = postings.get(ingredient_id, array('q'))
+            position, found = cls.find(posting, recipe_id)
+            if found:
+                continue
+            postings[ingredient_id] = (
+                posting[:position] + array('q', (recipe_id,))
+                + posting[position:]
+            )
+            totals[recipe_id] += 1
+
+    def update(self, recipe_id, added=(), removed=()):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append((recipe_id, added, removed))
+            if self.postings is not None:
+                self.apply(
+                    self.postings, self.totals, recipe_id, added, removed,
+                )
+        self.publish()
+
+    def count_matches(self, postings):
+        """Count the requested ingredients each candidate recipe uses.
+
+        Postings are merged shortest first. One longer than
+        `max_candidates` (a common ingredient) only adds to the counts
+        of the recipes already found, unless nothing was found yet:
+        recipes sharing nothing but common ingredients with the pantry
+        are not ranked, so a query does not score half the catalogue.
+        """
+        matched = Counter()
+        for posting in sorted(postings, key=len):
+            if not matched or len(posting) <= self.max_candidates:
+                matched.update(posting)
+            elif len(matched) * PROBE_FACTOR < len(posting):
+                for recipe_id in matched:
+                    if self.find(posting, recipe_id)[1]:
+                        matched[recipe_id] += 1
+            else:
+                for recipe_id in matched.keys() & set(posting):
+                    matched[recipe_id] += 1
+        return matched
+
+    def match(self, ingredient_ids, max_missing=None):
+        """Return the best (recipe id, matched, total) triples.
+
+        Recipes are ordered by coverage (matched / total), then by the
+        number of missing ingredients and by id, newest first.
+        """
+        self.ensure_built()
+        # Only the references are taken under the lock, the counting
+        # runs outside it so updates and rebuilds are not held up.
+        with self.lock:
+            totals = self.totals
+            postings = [
+                self.postings[ingredient_id]
+                for ingredient_id in set(ingredient_ids)
+                if ingredient_id in self.postings
+            ]
+        candidates = (
+            # The totals may already reflect a change the postings
+            # taken above do not.
+            (recipe_id, count, max(totals.get(recipe_id, 0), count))
+            for recipe_id, count in self.count_matches(postings).items()
+        )
+        if max_missing is not None:
+            candidates = (
+                candidate for candidate in candidates
+                if candidate[2] - candidate[1] <= max_missing
+            )
+        return heapq.nsmallest(
+            self.max_results, candidates,
+            key=lambda candidate: (
+                -candidate[1] / candidate[2],
+                candidate[2] - candidate[1],
+                -candidate[0],
+            ),
+        )
+
+
+pantry_index = PantryIndex(
+    settings.RECIPE_PANTRY_INDEX_TTL, settings.RECIPE_PANTRY_MAX_RESULTS,
+    settings.RECIPE_PANTRY_MAX_CANDIDATES,
+)
+
+
+def schedule_pantry_update(recipe_id, added=(), removed=()):
+    """Apply a change of recipe ingredients once the transaction commits.
+    """
+    added, removed = list(added), list(removed)
+    transaction.on_commit(
+        lambda: pantry_index.update(recipe_id, added, removed),
+    )
@@ -0,0 +1,68 @@
+from django.db import models
+from rest_framework import serializers
+
+from recipes.models import Cart, Favorite, Follow
+
+USER_RELATIONS_CONTEXT_KEY = 'user_relations'
+
+
+class UserRelations:
+    """Request-scoped sets of the current user's favorites, cart and follows.
+
+    Ids are loaded lazily, one query per relation for a whole batch of
+    objects (see `RelationListSerializer`); afterwards every check is a
+    set lookup.
+    """
+    RELATIONS = {
+        'favorites': (Favorite, 'recipe_id'),
+        'shopping_cart': (Cart, 'recipe_id'),
+        'following': (Follow, 'following_id'),
+    }
+
+    def __init__(self, user):
+        self.user = user
+        self.loaded = {name: set() for name in self.RELATIONS}
+        self.related = {name: set() for name in self.RELATIONS}
+
+    def load(self, name, ids):
+        ids = set(ids) - self.loaded[name]
+        if not ids or not self.user.is_authenticated:
+            return
+        model, field = self.RELATIONS[name]
+        self.related[name].update(
+            model.objects.filter(
+                user=self.user, **{f'{field}__in': ids},
+            ).values_list(field, flat=True)
+        )
+        self.loaded[name] |= ids
+
+    def has(self, name, obj_id):
+        if not self.user.is_authenticated:
+            return False
+        self.load(name, (obj_id,))
+        return obj_id in self.related[name]
+
+
+def get_user_relations(context):
+    relations = context.get(USER_RELATIONS_CONTEXT_KEY)
+    if relations is None:
+        request = context.get('request')
+        user = getattr(request, 'user', None)
+        if user is None:
+            return None
+        relations = context[USER_RELATIONS_CONTEXT_KEY] = UserRelations(user)
+    return relations
+
+
+class RelationListSerializer(serializers.ListSerializer):
+    """Let the child preload user relations for the whole page at once."""
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        relations = get_user_relations(self.context)
+        if relations is not None:
+            self.child.load_relations(relations, items)
+        return self.serialize(items)
+
+    def serialize(self, items):
+        return super().to_representation(items)
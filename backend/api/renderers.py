@@ -0,0 +1,177 @@
+import abc
+import csv
+import io
+import json
+import os
+
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework import renderers
+
+SHOPPING_LIST_TITLE = 'Список покупок пользователя: {} {}'
+SHOPPING_LIST_CREATED = 'Дата и время создания: {}'
+SHOPPING_LIST_SEPARATOR = '-----'
+SHOPPING_LIST_HEADER = ('Ингредиент', 'Количество', 'Единица измерения')
+SHOPPING_LIST_FOOTER = '*Сформировано в продуктовом помощнике Foodgram'
+
+PDF_FONT_NAME = 'ShoppingListFont'
+PDF_FALLBACK_FONT_NAME = 'Helvetica'
+PDF_FONT_SIZE = 11
+PDF_LINE_HEIGHT = 16
+PDF_MARGIN = 50
+
+
+class Echo:
+    """File-like object that returns the written value instead of buffering.
+    """
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer(abc.ABC, renderers.BaseRenderer):
+    """Base renderer of the shopping list download.
+
+    The DRF part (`render`) is only used for error responses; the list
+    itself is produced lazily by `stream` so it can be fed into a
+    `StreamingHttpResponse`.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = data.get('detail', data)
+        return str(data).encode(self.charset or 'utf-8')
+
+    @abc.abstractmethod
+    def stream(self, user, ingredients, created_time):
+        """Yield the shopping list in chunks for a streaming response."""
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, user, ingredients, created_time):
+        writer = csv.writer(Echo(), delimiter=',',
+                            quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        yield writer.writerow(
+            [SHOPPING_LIST_TITLE.format(user.first_name, user.last_name)]
+        )
+        yield writer.writerow([SHOPPING_LIST_CREATED.format(created_time)])
+        yield writer.writerow([SHOPPING_LIST_SEPARATOR])
+        yield writer.writerow(SHOPPING_LIST_HEADER)
+        for ingredient in ingredients:
+            yield writer.writerow(
+                [
+                    ingredient['ingredients'],
+                    ingredient['sum_amount'],
+                    ingredient['measure'],
+                ]
+            )
+        yield writer.writerow([SHOPPING_LIST_SEPARATOR])
+        yield writer.writerow([SHOPPING_LIST_FOOTER])
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, user, ingredients, created_time):
+        writer = csv.writer(Echo())
+        yield writer.writerow(SHOPPING_LIST_HEADER)
+        for ingredient in ingredients:
+            yield writer.writerow(
+                [
+                    ingredient['ingredients'],
+                    ingredient['sum_amount'],
+                    ingredient['measure'],
+                ]
+            )
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, user, ingredients, created_time):
+        yield '{"user": %s, "created": %s, "ingredients": [' % (
+            json.dumps(f'{user.first_name} {user.last_name}',
+                       ensure_ascii=False),
+            json.dumps(created_time),
+        )
+        separator = ''
+        for ingredient in ingredients:
+            yield separator + json.dumps(
+                {
+                    'name': ingredient['ingredients'],
+                    'amount': ingredient['sum_amount'],
+                    'measurement_unit': ingredient['measure'],
+                },
+                ensure_ascii=False,
+            )
+            separator = ', '
+        yield ']}'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """PDF shopping list.
+
+    PDF keeps a cross-reference table at the end of the file, so the
+    document is assembled in memory and sent as a single chunk.
+    """
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def get_font_name(self):
+        font_path = settings.SHOPPING_LIST_PDF_FONT
+        if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames():
+            return PDF_FONT_NAME
+        if not font_path or not os.path.exists(font_path):
+            return PDF_FALLBACK_FONT_NAME
+        pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, font_path))
+        return PDF_FONT_NAME
+
+    def stream(self, user, ingredients, created_time):
+        buffer = io.BytesIO()
+        font_name = self.get_font_name()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        _, height = A4
+        position = height - PDF_MARGIN
+
+        def write_line(text):
+            nonlocal position
+            if position < PDF_MARGIN:
+                pdf.showPage()
+                position = height - PDF_MARGIN
+            pdf.setFont(font_name, PDF_FONT_SIZE)
+            pdf.drawString(PDF_MARGIN, position, text)
+            position -= PDF_LINE_HEIGHT
+
+        write_line(SHOPPING_LIST_TITLE.format(user.first_name, user.last_name))
+        write_line(SHOPPING_LIST_CREATED.format(created_time))
+        write_line(SHOPPING_LIST_SEPARATOR)
+        for ingredient in ingredients:
+            write_line(
+                f'{ingredient["ingredients"]} — '
+                f'{ingredient["sum_amount"]} {ingredient["measure"]}'
+            )
+        write_line(SHOPPING_LIST_SEPARATOR)
+        write_line(SHOPPING_LIST_FOOTER)
+        pdf.save()
+        yield buffer.getvalue()
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+    ShoppingListPDFRenderer,
+)
@@ -0,0 +1,248 @@
+import bisect
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, FloatField, Value, When
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe
+
+TOKEN_RE = re.compile(r'\w+')
+MIN_TOKEN_LENGTH = 2
+# The ts_rank defaults for the A, B and C weights of `search_vector`.
+NAME_WEIGHT = 1.0
+INGREDIENT_WEIGHT = 0.4
+TEXT_WEIGHT = 0.2
+
+
+class DatabaseIngredientSearch:
+    """Prefix matches first, then substring matches, straight from the DB.
+
+    On PostgreSQL the lookups are served by the `text_pattern_ops` and
+    trigram indexes on UPPER(name) created in the recipes migrations.
+    """
+
+    def search(self, queryset, term, limit):
+        results = list(
+            queryset.filter(name__istartswith=term).order_by('name')[:limit]
+        )
+        if len(results) < limit:
+            results += queryset.filter(name__icontains=term).exclude(
+                name__istartswith=term,
+            ).order_by('name')[:limit - len(results)]
+        return results
+
+
+class InMemoryIngredientSearch:
+    """In-process index: a sorted array of lowercased ingredient names.
+
+    Prefix matches are found with a binary search, substring matches
+    with a scan of the array, so no query hits the database. It always
+    searches the whole catalog, ignoring the incoming queryset. The index
+    is built lazily, dropped by `invalidate` and rebuilt after the TTL
+    to pick up changes made by other processes.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = None
+        self.keys = None
+        self.built_at = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.entries = None
+
+    def get_index(self):
+        with self.lock:
+            expired = time.monotonic() - self.built_at > self.ttl
+            if self.entries is None or expired:
+                self.entries = sorted(
+                    (ingredient.name.lower(), ingredient.id, ingredient)
+                    for ingredient in Ingredient.objects.all().iterator()
+                )
+                self.keys = [entry[0] for entry in self.entries]
+                self.built_at = time.monotonic()
+            return self.keys, self.entries
+
+    def search(self, queryset, term, limit):
+        keys, entries = self.get_index()
+        term = term.lower()
+        results = []
+        position = bisect.bisect_left(keys, term)
+        while (
+            position < len(keys) and len(results) < limit
+            and keys[position].startswith(term)
+        ):
+            results.append(entries[position][2])
+            position += 1
+        if len(results) < limit:
+            for key, _, ingredient in entries:
+                if term in key and not key.startswith(term):
+                    results.append(ingredient)
+                    if len(results) == limit:
+                        break
+        return results
+
+
+_in_memory_search = InMemoryIngredientSearch(
+    settings.INGREDIENT_SEARCH_INDEX_TTL,
+)
+
+
+def get_ingredient_search():
+    backend = settings.INGREDIENT_SEARCH_BACKEND
+    if backend == 'auto':
+        backend = 'database' if connection.vendor == 'postgresql' else (
+            'memory'
+        )
+    if backend == 'memory':
+        return _in_memory_search
+    return DatabaseIngredientSearch()
+
+
+def invalidate_ingredient_search():
+    _in_memory_search.invalidate()
+
+
+def tokenize(text):
+    return [
+        token for token in TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+        if len(token) >= MIN_TOKEN_LENGTH
+    ]
+
+
+class DatabaseRecipeSearch:
+    """Match against `Recipe.search_vector` and rank with ts_rank.
+
+    The tsvector is kept up to date by the recipe serializer and admin
+    and served by the GIN index created in the recipes migrations.
+    """
+
+    def search(self, queryset, term):
+        query = SearchQuery(
+            term, config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch',
+        )
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+        )
+
+
+class InMemoryRecipeSearch:
+    """In-process inverted index: token -> {recipe id: weight}.
+
+    Every word of the term has to match the start of a token of the
+    recipe name, ingredient names or text, which stands in for stemming.
+    Matches are scored with the ts_rank weights of the same fields and
+    the best RECIPE_SEARCH_MAX_RESULTS are returned. Like the ingredient
+    index it is built lazily, dropped by `invalidate` and rebuilt after
+    the TTL.
+    """
+
+    def __init__(self, ttl, max_results):
+        self.ttl = ttl
+        self.max_results = max_results
+        self.lock = threading.Lock()
+        self.postings = None
+        self.tokens = None
+        self.built_at = 0
+
+    def invalidate(self):
+        with self.lock:
+            self.postings = None
+
+    def build(self):
+        postings = defaultdict(lambda: defaultdict(float))
+        for recipe_id, name, text in Recipe.objects.values_list(
+            'id', 'name', 'text',
+        ).iterator():
+            for token in tokenize(name):
+                postings[token][recipe_id] += NAME_WEIGHT
+            for token in tokenize(text):
+                postings[token][recipe_id] += TEXT_WEIGHT
+        for recipe_id, name in IngredientRecipe.objects.filter(
+            recipe__isnull=False,
+        ).values_list('recipe_id', 'ingredient__name').iterator():
+            for token in tokenize(name):
+                postings[token][recipe_id] += INGREDIENT_WEIGHT
+        return {token: dict(ids) for token, ids in postings.items()}
+
+    def get_index(self):
+        with self.lock:
+            expired = time.monotonic() - self.built_at > self.ttl
+            if self.postings is None or expired:
+                self.postings = self.build()
+                self.tokens = sorted(self.postings)
+                self.built_at = time.monotonic()
+            return self.tokens, self.postings
+
+    def match(self, tokens, postings, word):
+        scores = defaultdict(float)
+        position = bisect.bisect_left(tokens, word)
+        while position < len(tokens) and tokens[position].startswith(word):
+            for recipe_id, weight in postings[tokens[position]].items():
+                scores[recipe_id] = max(scores[recipe_id], weight)
+            position += 1
+        return scores
+
+    def rank(self, term):
+        tokens, postings = self.get_index()
+        ranks = None
+        for word in set(tokenize(term)):
+            scores = self.match(tokens, postings, word)
+            if ranks is None:
+                ranks = scores
+            else:
+                ranks = {
+                    recipe_id: rank + scores[recipe_id]
+                    for recipe_id, rank in ranks.items()
+                    if recipe_id in scores
+                }
+            if not ranks:
+                return {}
+        ranked = sorted(
+            (ranks or {}).items(), key=lambda item: (-item[1], -item[0]),
+        )
+        return dict(ranked[:self.max_results])
+
+    def search(self, queryset, term):
+        ranks = self.rank(term)
+        if not ranks:
+            return queryset.none().annotate(
+                search_rank=Value(0, output_field=FloatField()),
+            )
+        return queryset.filter(pk__in=ranks).annotate(
+            search_rank=Case(
+                *(
+                    When(pk=recipe_id, then=Value(rank))
+                    for recipe_id, rank in ranks.items()
+                ),
+                output_field=FloatField(),
+            ),
+        )
+
+
+_in_memory_recipe_search = InMemoryRecipeSearch(
+    settings.RECIPE_SEARCH_INDEX_TTL, settings.RECIPE_SEARCH_MAX_RESULTS,
+)
+
+
+def get_recipe_search():
+    backend = settings.RECIPE_SEARCH_BACKEND
+    if backend == 'auto':
+        backend = 'database' if connection.vendor == 'postgresql' else (
+            'memory'
+        )
+    if backend == 'memory':
+        return _in_memory_recipe_search
+    return DatabaseRecipeSearch()
+
+
+def invalidate_recipe_search():
+    _in_memory_recipe_search.invalidate()
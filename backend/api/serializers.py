@@ -1,16 +1,29 @@
+from collections import OrderedDict
+
 from django.contrib.auth import get_user_model
-from django.db.models import F
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.fields import ReadOnlyField
 from rest_framework.validators import UniqueTogetherValidator
 
-from recipes.models import (Cart, Favorite, Follow, Ingredient,
-                            IngredientRecipe, Recipe, Tag)
+from recipes.models import (Follow, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, Tag)
+from recipes.images import (IMAGE_VARIANTS, schedule_image_processing,
+                            schedule_variant_deletion)
 from core.constants import MIN_VALUE_AMOUNT
-from .fields import RelativeImageField
+from .cache import recipe_cache
+from .fields import (ImageVariantField, RelativeImageField,
+                     RelativeImageVariantField)
+from .pantry import schedule_pantry_update
+from .relations import RelationListSerializer, get_user_relations
+from .utils import get_recipe_prefetches
 
 User = get_user_model()
 
+MAX_PANTRY_INGREDIENTS = 100
+MAX_BULK_RECIPES = 100
+
 
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
@@ -21,12 +34,21 @@ class UserSerializer(serializers.ModelSerializer):
             'email', 'id', 'username',
             'first_name', 'last_name', 'is_subscribed',
         )
+        list_serializer_class = RelationListSerializer
+
+    @staticmethod
+    def load_relations(relations, users):
+        relations.load('following', (
+            user.id for user in users if not hasattr(user, 'is_subscribed')
+        ))
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return obj.following.filter(user=request.user).exists()
-        return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        relations = get_user_relations(self.context)
+        if relations is None:
+            return False
+        return relations.has('following', obj.id)
 
 
 class FollowSerializer(UserSerializer):
@@ -79,53 +101,133 @@ class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount', 'name', 'measurement_unit')
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
-    author = UserSerializer()
+class AuthorSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = User
+        fields = ('email', 'id', 'username', 'first_name', 'last_name')
+
+
+class RecipeFragmentSerializer(serializers.ModelSerializer):
+    """User-independent part of RecipeReadSerializer, cached per recipe."""
+    author = AuthorSerializer()
     ingredients = serializers.SerializerMethodField()
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
     tags = TagSerializer(many=True)
-    image = RelativeImageField()
+    image = RelativeImageVariantField('image_feed')
 
     class Meta:
         model = Recipe
+        fields = (
+            'id', 'tags', 'author', 'ingredients', 'name', 'image', 'text',
+            'cooking_time',
+        )
+
+    def get_ingredients(self, obj):
+        ingredients = []
+        for recipe_ingredient in obj.ingredientrecipe_set.all():
+            ingredient = recipe_ingredient.ingredient
+            ingredients.append({
+                'id': ingredient.id,
+                'name': ingredient.name,
+                'measurement_unit': ingredient.measurement_unit,
+                'amount': recipe_ingredient.amount,
+            })
+        return ingredients
+
+
+class RecipeListSerializer(RelationListSerializer):
+
+    def serialize(self, items):
+        return self.child.represent(items)
+
+
+class RecipeReadSerializer(RecipeFragmentSerializer):
+    """Cached recipe fragments merged with the current user's flags."""
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
+
+    class Meta(RecipeFragmentSerializer.Meta):
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
             'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time',
         )
         read_only_fields = ('author',)
+        list_serializer_class = RecipeListSerializer
 
-    def get_ingredients(self, obj):
-        ingredients = obj.ingredients.values(
-            'id', 'name',
-            'measurement_unit', amount=F('ingredientrecipe__amount'),
+    @staticmethod
+    def load_relations(relations, recipes):
+        recipe_ids = [
+            recipe.id for recipe in recipes
+            if not hasattr(recipe, 'is_favorited')
+        ]
+        relations.load('favorites', recipe_ids)
+        relations.load('shopping_cart', recipe_ids)
+        relations.load('following', (
+            recipe.author_id for recipe in recipes
+            if not hasattr(recipe, 'author_is_subscribed')
+        ))
+
+    def build_fragments(self, recipes):
+        prefetch_related_objects(recipes, *get_recipe_prefetches(), 'author')
+        serializer = RecipeFragmentSerializer(context=self.context)
+        return {
+            recipe.id: serializer.to_representation(recipe)
+            for recipe in recipes
+        }
+
+    def represent(self, recipes):
+        fragments = recipe_cache.get_many(recipes, self.build_fragments)
+        return [
+            self.add_user_flags(fragments[recipe.id], recipe)
+            for recipe in recipes
+        ]
+
+    def add_user_flags(self, fragment, recipe):
+        data = dict(
+            fragment,
+            author=OrderedDict(
+                fragment['author'],
+                is_subscribed=self.get_author_is_subscribed(recipe),
+            ),
+            is_favorited=self.get_is_favorited(recipe),
+            is_in_shopping_cart=self.get_is_in_shopping_cart(recipe),
         )
-        return ingredients
+        return OrderedDict((name, data[name]) for name in self.Meta.fields)
+
+    def to_representation(self, instance):
+        return self.represent([instance])[0]
+
+    def get_author_is_subscribed(self, obj):
+        if hasattr(obj, 'author_is_subscribed'):
+            return obj.author_is_subscribed
+        relations = get_user_relations(self.context)
+        if relations is None:
+            return False
+        return relations.has('following', obj.author_id)
 
     def get_is_favorited(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Favorite.objects.filter(
-                user=request.user, recipe=obj,
-            ).exists()
-        return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        relations = get_user_relations(self.context)
+        if relations is None:
+            return False
+        return relations.has('favorites', obj.id)
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Cart.objects.filter(
-                user=request.user, recipe=obj,
-            ).exists()
-        return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        relations = get_user_relations(self.context)
+        if relations is None:
+            return False
+        return relations.has('shopping_cart', obj.id)
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     default_error_messages = {
-        'ingredients_doesnt_exist': 'Такого ингредиента не существует',
+        'ingredients_doesnt_exist': 'Таких ингредиентов не существует: {ids}',
         'no_ingredients': 'Рецепт должен содержать минимум один ингредиент',
         'unique_ingredients': 'Ингредиенты для рецепта не должны повторяться',
         'invalid_amount': 'Неверное количество ингредиента',
-        'tags_doesnt_exist': 'Такого тега не существует',
         'no_tags': 'Рецепт должен содержать минимум один тег',
         'unique_tags': 'Теги для рецепта не должны повторяться',
         'no_image': 'Изображение должно быть установлено для рецепта',
@@ -146,56 +248,166 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe_ingredients = [
             IngredientRecipe(
                 recipe=recipe,
-                ingredient_id=ingredient_data.get('id'),
+                ingredient=ingredient_data['ingredient'],
                 amount=ingredient_data.get('amount'),
             )
             for ingredient_data in ingredients_data
         ]
         IngredientRecipe.objects.bulk_create(recipe_ingredients)
+        schedule_pantry_update(recipe.pk, added=(
+            recipe_ingredient.ingredient_id
+            for recipe_ingredient in recipe_ingredients
+        ))
+        # Reuse the validated instances for the response instead of
+        # reading the rows back.
+        recipe._prefetched_objects_cache['ingredientrecipe_set'] = sorted(
+            recipe_ingredients,
+            key=lambda recipe_ingredient: recipe_ingredient.ingredient.name,
+        )
+
+    @staticmethod
+    def set_tags(recipe, tags):
+        recipe.tags.set(tags)
+        recipe._prefetched_objects_cache['tags'] = sorted(
+            tags, key=lambda tag: tag.name,
+        )
 
     def create(self, validated_data):
         tags_data = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients')
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags_data)
-        recipe.save()
+        recipe._prefetched_objects_cache = {}
+        self.set_tags(recipe, tags_data)
         self.add_ingredients(ingredients_data, recipe)
+        Recipe.objects.filter(pk=recipe.pk).update_search_vectors()
+        schedule_image_processing(recipe)
         return recipe
 
     def validate_ingredients(self, ingredients):
         if not ingredients:
             self.fail('no_ingredients')
         ingredients_data = [ingredient.get('id') for ingredient in ingredients]
-        for ingredient_id in ingredients_data:
-            if not Ingredient.objects.filter(id=ingredient_id).exists():
-                self.fail('ingredients_doesnt_exist')
         if len(ingredients_data) != len(set(ingredients_data)):
             self.fail('unique_ingredients')
         for ingredient in ingredients:
             if int(ingredient.get('amount')) < MIN_VALUE_AMOUNT:
                 self.fail('invalid_amount')
+        ingredients_by_id = Ingredient.objects.in_bulk(ingredients_data)
+        missing_ids = [
+            ingredient_id for ingredient_id in ingredients_data
+            if ingredient_id not in ingredients_by_id
+        ]
+        if missing_ids:
+            self.fail(
+                'ingredients_doesnt_exist',
+                ids=', '.join(map(str, missing_ids)),
+            )
+        for ingredient in ingredients:
+            ingredient['ingredient'] = ingredients_by_id[ingredient['id']]
         return ingredients
 
     def validate_tags(self, tags):
+        # PrimaryKeyRelatedField has already loaded and checked the tags.
         if not tags:
             self.fail('no_tags')
-        tags_data = [tag.id for tag in tags]
-        for tag_id in tags_data:
-            if not Tag.objects.filter(id=tag_id).exists():
-                self.fail('tags_doesnt_exist')
         if len(tags) != len(set(tags)):
             self.fail('unique_tags')
         return tags
 
-    def update(self, instance, validated_data):
-        tags_data = validated_data.pop('tags', [])
-        ingredients_data = validated_data.pop('ingredients', [])
-        super().update(instance, validated_data)
+    def update_tags(self, recipe, tags):
+        current_ids = set(recipe.tags.values_list('id', flat=True))
+        new_ids = {tag.id for tag in tags}
+        if current_ids - new_ids:
+            recipe.tags.remove(*(current_ids - new_ids))
+        if new_ids - current_ids:
+            recipe.tags.add(*(new_ids - current_ids))
+        recipe._prefetched_objects_cache['tags'] = sorted(
+            tags, key=lambda tag: tag.name,
+        )
 
-        instance.tags.set(tags_data)
+    def update_ingredients(self, recipe, ingredients_data):
+        """Insert, update and delete only the changed IngredientRecipe rows.
+        """
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient
+            in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        old_amounts = {
+            ingredient_id: recipe_ingredient.amount
+            for ingredient_id, recipe_ingredient in current.items()
+        }
+        to_create, to_update, recipe_ingredients = [], [], []
+        for ingredient_data in ingredients_data:
+            ingredient = ingredient_data['ingredient']
+            amount = ingredient_data.get('amount')
+            recipe_ingredient = current.pop(ingredient.id, None)
+            if recipe_ingredient is None:
+                recipe_ingredient = IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=amount,
+                )
+                to_create.append(recipe_ingredient)
+            else:
+                recipe_ingredient.ingredient = ingredient
+                if recipe_ingredient.amount != amount:
+                    recipe_ingredient.amount = amount
+                    to_update.append(recipe_ingredient)
+            recipe_ingredients.append(recipe_ingredient)
+        if current:
+            IngredientRecipe.objects.filter(
+                pk__in=[item.pk for item in current.values()],
+            ).delete()
+        if to_create:
+            IngredientRecipe.objects.bulk_create(to_create)
+        # bulk_create sends no post_save; deleted rows are dropped from
+        # the pantry index by the post_delete signal.
+        schedule_pantry_update(
+            recipe.pk,
+            added=(recipe_ingredient.ingredient_id
+                   for recipe_ingredient in to_create),
+        )
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ('amount',))
+        recipe._prefetched_objects_cache['ingredientrecipe_set'] = sorted(
+            recipe_ingredients,
+            key=lambda recipe_ingredient: recipe_ingredient.ingredient.name,
+        )
+        ShoppingListItem.objects.change_recipe(
+            recipe,
+            old_amounts,
+            {
+                recipe_ingredient.ingredient_id: recipe_ingredient.amount
+                for recipe_ingredient in recipe_ingredients
+            },
+        )
 
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        self.add_ingredients(ingredients_data, instance)
+    def update(self, instance, validated_data):
+        tags_data = validated_data.pop('tags', None)
+        ingredients_data = validated_data.pop('ingredients', None)
+        with transaction.atomic():
+            # Lock the recipe and read the variants stored right now: the
+            # image worker may have added them after `instance` was loaded.
+            variants = Recipe.objects.select_for_update().filter(
+                pk=instance.pk,
+            ).values_list(*IMAGE_VARIANTS).get()
+            if 'image' in validated_data:
+                # The old variants no longer match the new image.
+                schedule_variant_deletion(variants)
+                instance.image_feed = instance.image_thumbnail = ''
+            super().update(instance, validated_data)
+            if 'image' in validated_data:
+                schedule_image_processing(instance)
+            instance._prefetched_objects_cache = {}
+            if tags_data is not None:
+                self.update_tags(instance, tags_data)
+            if ingredients_data is not None:
+                self.update_ingredients(instance, ingredients_data)
+            if ingredients_data is not None or (
+                {'name', 'text'} & validated_data.keys()
+            ):
+                Recipe.objects.filter(
+                    pk=instance.pk,
+                ).update_search_vectors()
         return instance
 
     def to_representation(self, instance):
@@ -204,6 +416,7 @@ class RecipeSerializer(serializers.ModelSerializer):
 
 
 class RecipeSmallSerializer(serializers.ModelSerializer):
+    image = ImageVariantField('image_thumbnail')
 
     class Meta:
         model = Recipe
@@ -211,38 +424,34 @@ class RecipeSmallSerializer(serializers.ModelSerializer):
         read_only_fields = ('__all__',)
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Favorite
-        fields = ('user', 'recipe')
-        validators = (
-            UniqueTogetherValidator(
-                queryset=Favorite.objects.all(),
-                fields=['recipe', 'user'],
-                message='Рецепт уже находится в Вашем избранном!',
-            ),
-        )
-
-    def to_representation(self, instance):
-        return RecipeSmallSerializer(instance.recipe).data
-
-
-class CartSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Cart
-        fields = ('user', 'recipe')
-        validators = (
-            UniqueTogetherValidator(
-                queryset=Cart.objects.all(),
-                fields=['recipe', 'user'],
-                message='Рецепт уже лежит в Вашей корзине!',
-            ),
-        )
+class PantrySerializer(serializers.Serializer):
+    """Query parameters of the pantry matching endpoint."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_PANTRY_INGREDIENTS,
+        error_messages={
+            'empty': 'Укажите хотя бы один ингредиент',
+            'max_length': 'Можно указать не больше {max_length} ингредиентов',
+        },
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Body of the bulk favorite and shopping cart endpoints."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+        error_messages={
+            'empty': 'Укажите хотя бы один рецепт',
+            'max_length': 'Можно указать не больше {max_length} рецептов',
+        },
+    )
 
-    def to_representation(self, instance):
-        return RecipeSmallSerializer(instance.recipe).data
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -259,24 +468,38 @@ class SubscribeSerializer(serializers.ModelSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed', 'recipes', 'recipes_count')
+        list_serializer_class = RelationListSerializer
+
+    @staticmethod
+    def load_relations(relations, follows):
+        relations.load('following', (
+            follow.following_id for follow in follows
+            if follow.user_id != relations.user.id
+        ))
 
     def get_recipes(self, obj):
-        recipes_set = obj.following.author_recipes.all()
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
-            recipes_set = recipes_set[:int(recipes_limit)]
+        author_recipes = self.context.get('author_recipes')
+        if author_recipes is not None:
+            recipes_set = author_recipes.get(obj.following_id, [])
+        else:
+            recipes_set = obj.following.author_recipes.all()
+            recipes_limit = request.query_params.get('recipes_limit')
+            if recipes_limit:
+                recipes_set = recipes_set[:int(recipes_limit)]
         return RecipeSmallSerializer(recipes_set, many=True).data
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Follow.objects.filter(
-                user=request.user, following=obj.following,
-            ).exists()
-        return False
+        relations = get_user_relations(self.context)
+        if relations is None or not relations.user.is_authenticated:
+            return False
+        if obj.user_id == relations.user.id:
+            return True
+        return relations.has('following', obj.following_id)
 
     def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
         return obj.following.author_recipes.count()
@@ -0,0 +1,113 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from core.signals import catalog_changed, recipes_changed
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from .cache import catalog_cache, recipe_cache, recipe_response_cache
+from .pantry import pantry_index, schedule_pantry_update
+from .search import invalidate_ingredient_search, invalidate_recipe_search
+
+User = get_user_model()
+
+
+def invalidate_recipes(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    transaction.on_commit(lambda: recipe_cache.invalidate(recipe_ids))
+    transaction.on_commit(recipe_response_cache.invalidate)
+    transaction.on_commit(invalidate_recipe_search)
+
+
+def invalidate_all_recipes():
+    recipe_cache.invalidate_all()
+    recipe_response_cache.invalidate()
+    invalidate_recipe_search()
+
+
+@receiver((post_save, post_delete, catalog_changed), sender=Ingredient)
+def invalidate_ingredient_catalog(sender, **kwargs):
+    # After the commit, or a concurrent read could cache the old rows
+    # under the new version.
+    transaction.on_commit(invalidate_ingredient_search)
+    transaction.on_commit(lambda: catalog_cache.invalidate('ingredients'))
+    transaction.on_commit(invalidate_all_recipes)
+
+
+@receiver((post_save, post_delete, catalog_changed), sender=Tag)
+def invalidate_tag_catalog(sender, **kwargs):
+    transaction.on_commit(lambda: catalog_cache.invalidate('tags'))
+    transaction.on_commit(invalidate_all_recipes)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    invalidate_recipes((instance.pk,))
+
+
+@receiver(recipes_changed, sender=Recipe)
+def invalidate_changed_recipes(sender, recipe_ids, **kwargs):
+    invalidate_recipes(recipe_ids)
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def invalidate_recipe_ingredients(sender, instance, **kwargs):
+    if instance.recipe_id is not None:
+        invalidate_recipes((instance.recipe_id,))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, pk_set,
+                           **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_recipes((instance.pk,))
+    elif pk_set:
+        invalidate_recipes(pk_set)
+    else:
+        transaction.on_commit(invalidate_all_recipes)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(sender, instance, update_fields, **kwargs):
+    # Logging in only touches last_login, which recipes do not show.
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    invalidate_recipes(
+        Recipe.objects.filter(author=instance).values_list('pk', flat=True)
+    )
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def add_pantry_ingredient(sender, instance, created, **kwargs):
+    if instance.recipe_id is None:
+        return
+    if created:
+        schedule_pantry_update(
+            instance.recipe_id, added=(instance.ingredient_id,),
+        )
+    else:
+        # The ingredient of the row may have been changed (admin inline).
+        transaction.on_commit(pantry_index.invalidate)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def discard_pantry_ingredient(sender, instance, **kwargs):
+    if instance.recipe_id is not None:
+        schedule_pantry_update(
+            instance.recipe_id, removed=(instance.ingredient_id,),
+        )
+
+
+@receiver(pre_delete, sender=Recipe)
+def discard_pantry_recipe(sender, instance, **kwargs):
+    # pre_delete: the ingredient rows lose their recipe (SET_NULL)
+    # before post_delete is sent.
+    schedule_pantry_update(
+        instance.pk,
+        removed=IngredientRecipe.objects.filter(
+            recipe=instance,
+        ).values_list('ingredient_id', flat=True),
+    )
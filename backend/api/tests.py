@@ -0,0 +1,400 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from base64 import b64encode, encodebytes
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
+from recipes.models import (Follow, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingListItem, Tag, TimelineEntry)
+
+from .fields import BASE64_CHUNK_SIZE, RelativeImageField
+
+User = get_user_model()
+
+
+def encode_cursor(position):
+    return b64encode(json.dumps(position).encode()).decode()
+
+
+@override_settings(TIMELINE_WORKERS=0)
+class RecipeCursorPaginationTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Автор', last_name='Рецептов',
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {index}', text='Текст',
+                cooking_time=5, image='recipes/images/recipe.png',
+                favorites_count=favorites_count,
+            )
+            for index, favorites_count in enumerate((3, 9, 1, 7, 5))
+        ]
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_cursor_walks_the_default_ordering(self):
+        self.assertEqual(
+            self.collect('/api/recipes/?cursor=&limit=2'),
+            [recipe.id for recipe in reversed(self.recipes)],
+        )
+
+    def test_custom_ordering_is_kept_across_pages(self):
+        recipes = sorted(
+            self.recipes, key=lambda recipe: recipe.favorites_count,
+            reverse=True,
+        )
+        self.assertEqual(
+            self.collect(
+                '/api/recipes/?cursor=&limit=2&ordering=-favorites_count'
+            ),
+            [recipe.id for recipe in recipes],
+        )
+
+    def test_malformed_cursor_is_not_found(self):
+        for position in (['x', 'y'], [{'a': 1}, 2], ['2020-01-01', 'zz']):
+            with self.subTest(position=position):
+                response = self.client.get(
+                    f'/api/recipes/?cursor={encode_cursor(position)}'
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+def make_image(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), color).save(buffer, format='PNG')
+    return f'data:image/png;base64,{b64encode(buffer.getvalue()).decode()}'
+
+
+class RecipeImageUpdateTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Автор', last_name='Рецептов',
+        )
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast',
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='сахар', measurement_unit='г',
+        )
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(
+            MEDIA_ROOT=media_root, RECIPE_IMAGE_WORKERS=0, TIMELINE_WORKERS=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_authenticate(self.author)
+        self.body = {
+            'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 5,
+            'image': make_image('orange'), 'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 100}],
+        }
+
+    def save(self, method, url, body, status):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(url, body, format='json')
+        self.assertEqual(response.status_code, status)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def test_new_image_deletes_the_old_variants(self):
+        recipe = self.save('post', '/api/recipes/', self.body, 201)
+        variants = [recipe.image_feed.name, recipe.image_thumbnail.name]
+        self.assertTrue(all(map(default_storage.exists, variants)))
+        recipe = self.save(
+            'patch', f'/api/recipes/{recipe.id}/',
+            dict(self.body, image=make_image('green')), 200,
+        )
+        self.assertFalse(any(map(default_storage.exists, variants)))
+        self.assertTrue(default_storage.exists(recipe.image_thumbnail.name))
+        self.assertNotIn(recipe.image_thumbnail.name, variants)
+
+    def test_same_image_keeps_the_variants(self):
+        recipe = self.save('post', '/api/recipes/', self.body, 201)
+        body = dict(self.body, cooking_time=10)
+        del body['image']
+        self.save('patch', f'/api/recipes/{recipe.id}/', body, 200)
+        self.assertTrue(default_storage.exists(recipe.image_thumbnail.name))
+
+
+@override_settings(TIMELINE_WORKERS=0, TIMELINE_FANOUT_MAX_FOLLOWERS=1)
+class TimelineTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.reader, cls.other = (
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='pass',
+                first_name='Имя', last_name='Фамилия',
+            )
+            for name in ('author', 'reader', 'other')
+        )
+
+    def create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Recipe.objects.create(
+                author=self.author, name='Рецепт', text='Текст',
+                cooking_time=5, image='recipes/images/recipe.png',
+            )
+
+    def subscribe(self, user, method='post'):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                f'/api/users/{self.author.id}/subscribe/'
+            )
+        self.assertIn(response.status_code, (201, 204))
+
+    def timeline(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/users/timeline/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_follow_backfills_existing_recipes(self):
+        recipes = [self.create_recipe(), self.create_recipe()]
+        self.subscribe(self.reader)
+        self.assertEqual(
+            self.timeline(self.reader),
+            [recipe.id for recipe in reversed(recipes)],
+        )
+
+    def test_backfill_after_crossing_the_fan_out_threshold(self):
+        self.subscribe(self.reader)
+        fanned_out = self.create_recipe()
+        self.subscribe(self.other)
+        read_from_author = self.create_recipe()
+        fanned_out.refresh_from_db()
+        read_from_author.refresh_from_db()
+        self.assertTrue(fanned_out.in_timelines)
+        self.assertFalse(read_from_author.in_timelines)
+        for user in (self.reader, self.other):
+            with self.subTest(user=user.username):
+                self.assertEqual(
+                    self.timeline(user), [read_from_author.id, fanned_out.id],
+                )
+
+    def test_unfollow_hides_entries_inserted_afterwards(self):
+        self.subscribe(self.reader)
+        recipe = self.create_recipe()
+        self.assertEqual(self.timeline(self.reader), [recipe.id])
+        self.subscribe(self.reader, method='delete')
+        self.assertFalse(Follow.objects.filter(user=self.reader).exists())
+        # A fan-out batch that read the followers before the unfollow.
+        TimelineEntry.objects.create(
+            user=self.reader, recipe=recipe, author=self.author,
+        )
+        self.assertEqual(self.timeline(self.reader), [])
+
+
+@override_settings(TIMELINE_WORKERS=0)
+class ShoppingListTotalsTests(APITestCase):
+    """The stored totals always equal the ones aggregated from carts."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.buyer = (
+            User.objects.create_superuser(
+                username=name, email=f'{name}@example.com', password='pass',
+                first_name='Имя', last_name='Фамилия',
+            )
+            for name in ('author', 'buyer')
+        )
+        cls.tag = Tag.objects.create(
+            name='Обед', color='#E26C2D', slug='lunch',
+        )
+        cls.flour, cls.sugar, cls.salt = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'сахар', 'соль')
+        )
+        cls.pie, cls.cake, cls.bread = (
+            cls.create_recipe(name, amounts)
+            for name, amounts in (
+                ('Пирог', {cls.flour: 300, cls.sugar: 100}),
+                ('Торт', {cls.sugar: 200, cls.salt: 5}),
+                ('Хлеб', {cls.flour: 500, cls.salt: 10}),
+            )
+        )
+
+    @classmethod
+    def create_recipe(cls, name, amounts):
+        recipe = Recipe.objects.create(
+            author=cls.author, name=name, text='Текст', cooking_time=5,
+            image='recipes/images/recipe.png',
+        )
+        recipe.tags.set([cls.tag])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                             amount=amount)
+            for ingredient, amount in amounts.items()
+        )
+        return recipe
+
+    def request(self, user, method, url, data=None, status=200):
+        self.client.force_authenticate(user)
+        response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(response.status_code, status, response.data)
+
+    def assertTotalsMatchCarts(self):
+        stored = {
+            (user_id, ingredient_id): total
+            for user_id, ingredient_id, total
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount',
+            )
+        }
+        self.assertEqual(
+            stored, ShoppingListItem.objects.get_source_totals(),
+        )
+        return stored
+
+    def test_cart_and_recipe_changes(self):
+        steps = (
+            (self.buyer, 'post', f'/api/recipes/{self.pie.id}/shopping_cart/',
+             None, 201),
+            (self.author, 'post',
+             f'/api/recipes/{self.pie.id}/shopping_cart/', None, 201),
+            (self.buyer, 'post', '/api/recipes/shopping_cart/',
+             {'recipes': [self.cake.id, self.bread.id]}, 201),
+            (self.author, 'patch', f'/api/recipes/{self.pie.id}/', {
+                'tags': [self.tag.id],
+                'ingredients': [
+                    {'id': self.flour.id, 'amount': 250},
+                    {'id': self.salt.id, 'amount': 3},
+                ],
+            }, 200),
+            (self.buyer, 'delete',
+             f'/api/recipes/{self.cake.id}/shopping_cart/', None, 204),
+            (self.author, 'delete', f'/api/recipes/{self.pie.id}/', None,
+             204),
+            (self.buyer, 'delete', '/api/recipes/shopping_cart/',
+             {'recipes': [self.bread.id]}, 204),
+        )
+        for user, method, url, data, status in steps:
+            with self.subTest(method=method, url=url):
+                self.request(user, method, url, data, status)
+                self.assertTotalsMatchCarts()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_recipe_in_several_carts(self):
+        for user in (self.buyer, self.author):
+            self.request(
+                user, 'post', '/api/recipes/shopping_cart/',
+                {'recipes': [self.pie.id, self.bread.id]}, 201,
+            )
+        self.assertEqual(
+            self.assertTotalsMatchCarts()[self.buyer.id, self.flour.id], 800,
+        )
+        self.request(self.author, 'delete', f'/api/recipes/{self.pie.id}/',
+                     status=204)
+        self.assertEqual(
+            self.assertTotalsMatchCarts()[self.buyer.id, self.flour.id], 500,
+        )
+
+    def test_admin_inline_edit(self):
+        self.request(self.buyer, 'post',
+                     f'/api/recipes/{self.pie.id}/shopping_cart/', status=201)
+        rows = list(IngredientRecipe.objects.filter(recipe=self.pie))
+        prefix = 'ingredientrecipe_set'
+        data = {
+            'author': self.author.id, 'name': self.pie.name,
+            'text': self.pie.text, 'cooking_time': 5, 'tags': [self.tag.id],
+            f'{prefix}-TOTAL_FORMS': len(rows) + 1,
+            f'{prefix}-INITIAL_FORMS': len(rows),
+            f'{prefix}-MIN_NUM_FORMS': 1,
+            f'{prefix}-MAX_NUM_FORMS': 1000,
+            f'{prefix}-{len(rows)}-recipe': self.pie.id,
+            f'{prefix}-{len(rows)}-ingredient': self.salt.id,
+            f'{prefix}-{len(rows)}-amount': 7,
+        }
+        for number, row in enumerate(rows):
+            data.update({
+                f'{prefix}-{number}-id': row.id,
+                f'{prefix}-{number}-recipe': self.pie.id,
+                f'{prefix}-{number}-ingredient': row.ingredient_id,
+                f'{prefix}-{number}-amount': row.amount * 2,
+            })
+            if row.ingredient_id == self.sugar.id:
+                data[f'{prefix}-{number}-DELETE'] = 'on'
+        self.client.force_login(self.author)
+        response = self.client.post(
+            f'/admin/recipes/recipe/{self.pie.id}/change/', data,
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.assertTotalsMatchCarts(), {
+            (self.buyer.id, self.flour.id): 600,
+            (self.buyer.id, self.salt.id): 7,
+        })
+
+
+class RelativeImageFieldTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Noise does not compress, so the encoding spans several chunks.
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (200, 200), os.urandom(200 * 200 * 3)).save(
+            buffer, format='PNG',
+        )
+        cls.image = buffer.getvalue()
+
+    def decode(self, encoded):
+        self.assertGreater(len(encoded), 2 * BASE64_CHUNK_SIZE)
+        file = RelativeImageField().to_internal_value(
+            f'data:image/png;base64,{encoded}'
+        )
+        self.addCleanup(file.close)
+        file.seek(0)
+        return file.read()
+
+    def test_decodes_unwrapped_base64(self):
+        self.assertEqual(self.decode(b64encode(self.image).decode()),
+                         self.image)
+
+    def test_decodes_line_wrapped_base64(self):
+        for line_break in ('\n', '\r\n'):
+            with self.subTest(line_break=repr(line_break)):
+                encoded = encodebytes(self.image).decode()
+                self.assertEqual(
+                    self.decode(encoded.replace('\n', line_break)),
+                    self.image,
+                )
+
+    def test_size_limit_counts_padding_before_trailing_whitespace(self):
+        # 100 bytes encode with '==' padding, followed by a line break.
+        encoded = encodebytes(bytes(100)).decode() + ' \n'
+        field = RelativeImageField()
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=100):
+            file = field.decode_to_file(encoded, 0)
+            self.addCleanup(file.close)
+            self.assertEqual(file.size, 100)
+        with override_settings(RECIPE_IMAGE_MAX_SIZE=99):
+            with self.assertRaises(ValidationError):
+                field.decode_to_file(encoded, 0)
@@ -1,30 +1,72 @@
-import csv
+from collections import defaultdict
 
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
-from django.http.response import HttpResponse
+from django.http.response import StreamingHttpResponse
 
+from recipes.models import IngredientRecipe, Recipe
 
-def build_file(user, ingredients, filename='shopping_list.txt'):
+
+def get_recipe_prefetches():
+    """Lookups that RecipeReadSerializer needs prefetched."""
+    return (
+        'tags',
+        Prefetch(
+            'ingredientrecipe_set',
+            queryset=IngredientRecipe.objects.select_related(
+                'ingredient',
+            ).order_by('ingredient__name'),
+        ),
+    )
+
+
+def stream_shopping_list(user, ingredients, renderer):
+    """Stream the shopping list rendered by one of SHOPPING_LIST_RENDERERS.
+    """
     created_time = timezone.now().strftime('%d.%m.%Y %H:%M')
+    content_type = renderer.media_type
+    if renderer.charset:
+        content_type += f'; charset={renderer.charset}'
+    response = StreamingHttpResponse(
+        renderer.stream(user, ingredients, created_time),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename=shopping_list.{renderer.format}'
+    )
+    return response
 
-    response = HttpResponse(content_type='text/plain; charset=utf-8')
-    response['Content-Disposition'] = f'attachment; filename={filename}'
-
-    writer = csv.writer(response, delimiter=',',
-                        quotechar='"', quoting=csv.QUOTE_MINIMAL)
-    writer.writerow([f'Список покупок пользователя: {user.first_name} '
-                     f'{user.last_name}', ])
-    writer.writerow([f'Дата и время создания: {created_time}', ])
-    writer.writerow(['-----', ])
-    writer.writerow(['Ингредиент', 'Количество', 'Единица измерения'])
-    for ingredient in ingredients:
-        writer.writerow(
-            [
-                ingredient['ingredients'],
-                ingredient['sum_amount'],
-                ingredient['measure'],
-            ]
+
+def get_recipes_by_author(author_ids, limit=None):
+    """Fetch recipes of several authors at once, at most `limit` each.
+
+    The per-author limit is applied with ROW_NUMBER() partitioned by
+    author, so the whole page of subscriptions costs one query.
+    """
+    recipes = Recipe.objects.filter(author_id__in=author_ids).only(
+        'id', 'name', 'image', 'image_thumbnail', 'cooking_time',
+        'author_id',
+    )
+    if limit is not None:
+        ranked = recipes.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('name').asc()),
+            ),
+        ).values(
+            'id', 'name', 'image', 'image_thumbnail', 'cooking_time',
+            'author_id', 'pub_date', 'row_number',
         )
-    writer.writerow(['-----', ])
-    writer.writerow(['*Сформировано в продуктовом помощнике Foodgram', ])
-    return response
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            'WHERE ranked.row_number <= %s '
+            'ORDER BY ranked.pub_date DESC, ranked.name ASC',
+            (*params, limit),
+        )
+    author_recipes = defaultdict(list)
+    for recipe in recipes:
+        author_recipes[recipe.author_id].append(recipe)
+    return author_recipes
@@ -1,27 +1,43 @@
 from django.contrib.auth import get_user_model
-from django.db.models import F, Sum
+from django.db.models import Count, Exists, F, OuterRef
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from recipes.models import (Cart, Favorite, Follow, Ingredient,
-                            IngredientRecipe, Recipe, Tag)
-from .filters import IngredientSearchFilter, RecipeFilter
-from .mixins import RetrieveListViewSet
+from recipes.models import (Cart, Favorite, Follow, Ingredient, Recipe,
+                            RecipeNeighbor, ShoppingListItem, Tag)
+from recipes.timeline import get_timeline_sources
+from .filters import (IngredientSearchFilter, RecipeFilter,
+                      RecipeSearchFilter)
+from .cache import recipe_response_cache
+from .mixins import AnonymousResponseCacheMixin, CachedCatalogViewSet
+from .pantry import pantry_index
 from .permissions import AuthorOrReadOnly
-from .serializers import (CartSerializer, FavoriteSerializer, FollowSerializer,
-                          IngredientSerializer, RecipeSerializer,
-                          SubscribeSerializer, TagSerializer,
-                          UserSerializer)
-from .utils import build_file
-from .pagination import UserPagination, RecipePagination
+from .serializers import (FollowSerializer, IngredientSerializer,
+                          PantrySerializer, RecipeIdsSerializer,
+                          RecipeReadSerializer, RecipeSerializer,
+                          RecipeSmallSerializer, SubscribeSerializer,
+                          TagSerializer, UserSerializer)
+from .utils import get_recipes_by_author, stream_shopping_list
+from .pagination import (PantryPagination, RecipePagination,
+                         TimelinePagination, UserPagination)
+from .renderers import SHOPPING_LIST_RENDERERS
 
 User = get_user_model()
 
+SHOPPING_LIST_CHUNK_SIZE = 2000
+SIMILARITY_PRECISION = 4
+
+ERR_IN_FAVORITES = 'Рецепт уже находится в Вашем избранном!'
+ERR_IN_CART = 'Рецепт уже лежит в Вашей корзине!'
+ERR_RECIPES_NOT_FOUND = 'Рецепты не найдены: {}'
+
 
 class UserViewSet(DjoserUserViewSet):
     serializer_class = UserSerializer
@@ -61,24 +77,59 @@ class UserViewSet(DjoserUserViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscriptions(self, request):
+        page = self.paginate_queryset(
+            Follow.objects.filter(user=request.user).select_related(
+                'following',
+            ).annotate(
+                recipes_count=Count('following__author_recipes'),
+            ).order_by('id')
+        )
+        recipes_limit = request.query_params.get('recipes_limit')
+        author_recipes = get_recipes_by_author(
+            [follow.following_id for follow in page],
+            int(recipes_limit) if recipes_limit else None,
+        )
         return self.get_paginated_response(
             SubscribeSerializer(
-                self.paginate_queryset(
-                    Follow.objects.filter(user=request.user)
-                ),
+                page,
                 many=True,
-                context={'request': request}
+                context={
+                    'request': request,
+                    'author_recipes': author_recipes,
+                },
+            ).data
+        )
+
+    @action(
+        methods=('GET',),
+        detail=False,
+        permission_classes=[IsAuthenticated],
+    )
+    def timeline(self, request):
+        """Recipes of the followed authors, newest first, by cursor."""
+        paginator = TimelinePagination()
+        page = paginator.paginate_queryset(
+            Recipe.objects.defer('search_vector'),
+            request,
+            self,
+            sources=get_timeline_sources(request.user),
+        )
+        return paginator.get_paginated_response(
+            RecipeReadSerializer(
+                page, many=True, context=self.get_serializer_context(),
             ).data
         )
 
 
-class TagViewSet(RetrieveListViewSet):
+class TagViewSet(CachedCatalogViewSet):
+    catalog_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
 
-class IngredientViewSet(RetrieveListViewSet):
+class IngredientViewSet(CachedCatalogViewSet):
+    catalog_name = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
@@ -86,55 +137,218 @@ class IngredientViewSet(RetrieveListViewSet):
     search_fields = ('name',)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(AnonymousResponseCacheMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (AuthorOrReadOnly,)
     pagination_class = RecipePagination
-    filter_backends = (DjangoFilterBackend, filters.OrderingFilter)
+    # RecipeSearchFilter goes last to order the matches by rank.
+    filter_backends = (
+        DjangoFilterBackend, filters.OrderingFilter, RecipeSearchFilter,
+    )
     filterset_class = RecipeFilter
+    ordering_fields = ('pub_date', 'favorites_count', 'cart_count')
     ordering = ('-pub_date',)
+    response_cache = recipe_response_cache
+    cached_query_params = ('page', 'limit', 'tags', 'author', 'ordering')
+
+    def get_queryset(self):
+        # Ingredients, tags and authors are loaded by RecipeReadSerializer
+        # only for recipes missing from the fragment cache.
+        user = self.request.user
+        # The tsvector is only needed by the WHERE clause of ?search=.
+        queryset = Recipe.objects.defer('search_vector')
+        if user.is_authenticated:
+            queryset = queryset.annotate(
+                is_favorited=Exists(
+                    Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+                ),
+                is_in_shopping_cart=Exists(
+                    Cart.objects.filter(user=user, recipe=OuterRef('pk'))
+                ),
+                author_is_subscribed=Exists(
+                    Follow.objects.filter(
+                        user=user, following=OuterRef('author_id'),
+                    )
+                ),
+            )
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve', 'pantry', 'similar'):
+            return RecipeReadSerializer
+        return RecipeSerializer
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     @staticmethod
-    def create_object(serializers, user, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        data = {'user': user.id, 'recipe': recipe.id}
-        serializer = serializers(data=data)
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    def add_recipe(model, user, pk, error):
+        recipe = get_object_or_404(
+            Recipe.objects.defer('search_vector'), id=pk,
+        )
+        # The unique (user, recipe) constraint resolves duplicates in the
+        # INSERT itself, no existence check is made beforehand.
+        if not model.objects.add_recipes(user.id, [recipe.id]):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [error]})
+        return Response(
+            RecipeSmallSerializer(recipe).data, status=status.HTTP_201_CREATED,
+        )
 
     @staticmethod
-    def delete_object(request, pk, model):
-        recipe_obj = get_object_or_404(Recipe, id=pk)
-        get_object_or_404(model, user=request.user, recipe=recipe_obj).delete()
+    def remove_recipe(model, user, pk):
+        if not model.objects.remove_recipes(user.id, [pk]):
+            raise NotFound()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @staticmethod
+    def add_recipes(model, request):
+        params = RecipeIdsSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        recipe_ids = params.validated_data['recipes']
+        recipes = Recipe.objects.defer('search_vector').in_bulk(recipe_ids)
+        missing = [
+            str(recipe_id) for recipe_id in recipe_ids
+            if recipe_id not in recipes
+        ]
+        if missing:
+            raise ValidationError({
+                'recipes': [ERR_RECIPES_NOT_FOUND.format(', '.join(missing))],
+            })
+        # Recipes already in the list are left as they are.
+        model.objects.add_recipes(request.user.id, recipe_ids)
+        return Response(
+            RecipeSmallSerializer(
+                [recipes[recipe_id] for recipe_id in recipe_ids], many=True,
+            ).data,
+            status=status.HTTP_201_CREATED,
+        )
+
+    @staticmethod
+    def remove_recipes(model, request):
+        params = RecipeIdsSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        model.objects.remove_recipes(
+            request.user.id, params.validated_data['recipes'],
+        )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(methods=('POST',), detail=True)
     def favorite(self, request, pk):
-        return self.create_object(FavoriteSerializer, request.user, pk)
+        return self.add_recipe(Favorite, request.user, pk, ERR_IN_FAVORITES)
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk):
-        return self.delete_object(request=request, pk=pk, model=Favorite)
+        return self.remove_recipe(Favorite, request.user, pk)
+
+    @action(
+        methods=('POST',),
+        detail=False,
+        url_path='favorite',
+        url_name='favorite-many',
+    )
+    def favorite_many(self, request):
+        """Add the recipes of {"recipes": [id, ...]} to the favorites."""
+        return self.add_recipes(Favorite, request)
+
+    @favorite_many.mapping.delete
+    def delete_favorite_many(self, request):
+        return self.remove_recipes(Favorite, request)
 
     @action(methods=('POST',), detail=True)
     def shopping_cart(self, request, pk):
-        return self.create_object(CartSerializer, request.user, pk)
+        return self.add_recipe(Cart, request.user, pk, ERR_IN_CART)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
-        return self.delete_object(request=request, pk=pk, model=Cart)
+        return self.remove_recipe(Cart, request.user, pk)
+
+    @action(
+        methods=('POST',),
+        detail=False,
+        url_path='shopping_cart',
+        url_name='shopping-cart-many',
+    )
+    def shopping_cart_many(self, request):
+        """Put the recipes of {"recipes": [id, ...]} in the shopping cart.
+        """
+        return self.add_recipes(Cart, request)
+
+    @shopping_cart_many.mapping.delete
+    def delete_shopping_cart_many(self, request):
+        return self.remove_recipes(Cart, request)
+
+    @action(
+        methods=('GET',),
+        detail=False,
+        pagination_class=PantryPagination,
+    )
+    def pantry(self, request):
+        """Recipes ranked by the share of their ingredients in ?ingredients.
+        """
+        params = PantrySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        page = self.paginate_queryset(pantry_index.match(
+            params.validated_data['ingredients'],
+            params.validated_data.get('max_missing'),
+        ))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page]
+        )
+        # Recipes deleted by other processes may linger in the index.
+        page = [
+            (recipes[recipe_id], matched, total)
+            for recipe_id, matched, total in page if recipe_id in recipes
+        ]
+        data = self.get_serializer(
+            [recipe for recipe, _, _ in page], many=True,
+        ).data
+        return self.get_paginated_response([
+            dict(
+                item,
+                matched_ingredients=matched,
+                missing_ingredients=total - matched,
+            )
+            for item, (_, matched, total) in zip(data, page)
+        ])
+
+    @action(methods=('GET',), detail=True)
+    def similar(self, request, pk):
+        """Neighbors stored by the `update_recipe_neighbors` command."""
+        recipe = get_object_or_404(Recipe.objects.only('pk'), id=pk)
+        neighbors = list(
+            RecipeNeighbor.objects.filter(recipe=recipe).order_by(
+                '-score',
+            ).values_list('neighbor_id', 'score')
+        )
+        recipes = self.get_queryset().in_bulk(
+            [neighbor_id for neighbor_id, _ in neighbors]
+        )
+        neighbors = [
+            (recipes[neighbor_id], score)
+            for neighbor_id, score in neighbors if neighbor_id in recipes
+        ]
+        data = self.get_serializer(
+            [neighbor for neighbor, _ in neighbors], many=True,
+        ).data
+        return Response([
+            dict(item, similarity=round(score, SIMILARITY_PRECISION))
+            for item, (_, score) in zip(data, neighbors)
+        ])
 
-    @action(methods=('GET',), detail=False)
+    @action(
+        methods=('GET',),
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+    )
     def download_shopping_cart(self, request):
         user = self.request.user
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__shopping_cart__user=user).values(
+        ingredients = ShoppingListItem.objects.filter(user=user).values(
             ingredients=F('ingredient__name'),
-            measure=F('ingredient__measurement_unit')).order_by(
-            'ingredient').annotate(sum_amount=Sum('amount'))
-        return build_file(user, ingredients)
+            measure=F('ingredient__measurement_unit'),
+            sum_amount=F('total_amount')).order_by(
+            'ingredient').iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
+        return stream_shopping_list(
+            user, ingredients, request.accepted_renderer,
+        )
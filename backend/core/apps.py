@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_finished, request_started
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import checks  # noqa: F401
+        from .db import check_connection_health, mark_connections_idle
+        if (
+            settings.DB_CONNECTION_STRATEGY == 'persistent'
+            and settings.DB_CONN_HEALTH_CHECKS
+        ):
+            request_started.connect(check_connection_health)
+            request_finished.connect(mark_connections_idle)
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import psycopg2.extras
+from django.conf import settings
+from django.db.backends.postgresql import base
+from psycopg2.pool import ThreadedConnectionPool
+
+ERR_POOL_EXHAUSTED = ('No free database connection in the pool after {}s, '
+                      'raise DB_POOL_SIZE or lower the worker threads.')
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """psycopg2 ThreadedConnectionPool that waits for a free connection."""
+
+    def __init__(self, size, conn_params):
+        self.pool = ThreadedConnectionPool(0, size, **conn_params)
+        # Keep every connection open after it is returned.
+        self.pool.minconn = size
+        self.slots = threading.BoundedSemaphore(size)
+        self.returned_at = {}
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=settings.DB_POOL_TIMEOUT):
+            raise base.Database.OperationalError(
+                ERR_POOL_EXHAUSTED.format(settings.DB_POOL_TIMEOUT)
+            )
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def idle_for(self, connection):
+        """Seconds since the connection was returned, 0 for new ones."""
+        returned_at = self.returned_at.pop(id(connection), None)
+        return 0 if returned_at is None else time.monotonic() - returned_at
+
+    def putconn(self, connection, close=False):
+        if not close:
+            self.returned_at[id(connection)] = time.monotonic()
+        try:
+            self.pool.putconn(connection, close=close)
+        finally:
+            self.slots.release()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL backend sharing a per-process pool between threads.
+
+    Closing the Django connection (at the end of every request, as
+    CONN_MAX_AGE is 0) returns it to the pool, rolled back if needed.
+    """
+
+    def get_pool(self, conn_params):
+        with _pools_lock:
+            pool = _pools.get(self.alias)
+            if pool is None:
+                pool = _pools[self.alias] = ConnectionPool(
+                    settings.DB_POOL_SIZE, conn_params,
+                )
+            return pool
+
+    @staticmethod
+    def ping(connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except base.Database.Error:
+            return False
+        return True
+
+    def is_stale(self, pool, connection):
+        if connection.closed:
+            return True
+        return (
+            settings.DB_CONN_HEALTH_CHECKS
+            and pool.idle_for(connection) >= settings.DB_CONN_HEALTH_CHECK_AGE
+            and not self.ping(connection)
+        )
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        # Discard stale pooled connections until one passes the ping;
+        # once the pool runs out, getconn opens a fresh connection.
+        while True:
+            connection = pool.getconn()
+            if not self.is_stale(pool, connection):
+                break
+            pool.putconn(connection, close=True)
+        # Same session setup as the stock backend performs on connect.
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level,
+        )
+        if self.isolation_level != connection.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(
+            conn_or_curs=connection, loads=lambda x: x,
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        pool = _pools.get(self.alias)
+        with self.wrap_database_errors:
+            if pool is None:
+                return self.connection.close()
+            pool.putconn(self.connection, close=bool(self.connection.closed))
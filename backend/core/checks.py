@@ -0,0 +1,55 @@
+import os
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+from .db import CONNECTION_STRATEGIES, POOL_ENGINE
+
+
+@register(Tags.database)
+def check_connection_strategy(app_configs, **kwargs):
+    strategy = settings.DB_CONNECTION_STRATEGY
+    if strategy not in CONNECTION_STRATEGIES:
+        return [Error(
+            f'Unknown DB_CONNECTION_STRATEGY {strategy!r}.',
+            hint=f'Use one of: {", ".join(CONNECTION_STRATEGIES)}.',
+            id='core.E001',
+        )]
+    errors = []
+    threads = int(os.getenv('GUNICORN_THREADS', 1))
+    engine = settings.DATABASES['default']['ENGINE']
+    if strategy == 'pool' and engine != POOL_ENGINE:
+        errors.append(Error(
+            f'DB_CONNECTION_STRATEGY is pool, but the engine is {engine}.',
+            id='core.E002',
+        ))
+    if strategy == 'pool' and settings.DB_POOL_SIZE < threads:
+        errors.append(Warning(
+            f'DB_POOL_SIZE={settings.DB_POOL_SIZE} is lower than '
+            f'GUNICORN_THREADS={threads}, threads will wait for '
+            'connections.',
+            id='core.W001',
+        ))
+    if strategy == 'persistent' and threads > 1:
+        errors.append(Warning(
+            f'Persistent connections with {threads} threads keep up to '
+            f'{threads} connections open per worker process.',
+            hint='Consider DB_CONNECTION_STRATEGY=pool for threaded '
+                 'workers.',
+            id='core.W002',
+        ))
+    return errors
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.API_CACHE_ENABLED:
+        return []
+    return [Warning(
+        f'The cache backend is local to each of the '
+        f'{settings.GUNICORN_WORKERS} gunicorn workers, the catalog, '
+        'recipe fragment and response caches are disabled.',
+        hint='Set CACHE_BACKEND and CACHE_LOCATION to a shared cache, '
+             'e.g. Memcached.',
+        id='core.W003',
+    )]
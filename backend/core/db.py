@@ -0,0 +1,59 @@
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+
+CONNECTION_STRATEGIES = ('per-request', 'persistent', 'pool')
+POOL_ENGINE = 'core.backends.postgresql_pool'
+
+
+def mark_connections_idle(**kwargs):
+    """Remember when each kept connection was last used by a request."""
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.idle_since = now
+
+
+def check_connection_health(**kwargs):
+    """Drop persistent connections the database has closed meanwhile.
+
+    Django 3.2 has no CONN_HEALTH_CHECKS; this runs on request_started,
+    after close_old_connections, and pings only connections idle for
+    longer than DB_CONN_HEALTH_CHECK_AGE, so back-to-back requests do
+    not pay for a round trip. Connections that raised an error are
+    already checked by close_old_connections at the end of the request.
+    """
+    now = time.monotonic()
+    for connection in connections.all():
+        if (
+            connection.connection is not None
+            and not connection.in_atomic_block
+            and now - getattr(connection, 'idle_since', now)
+            >= settings.DB_CONN_HEALTH_CHECK_AGE
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+def describe_connection_strategy():
+    database = settings.DATABASES['default']
+    strategy = settings.DB_CONNECTION_STRATEGY
+    if strategy == 'pool':
+        details = (f'{settings.DB_POOL_SIZE} connections per process, '
+                   f'wait up to {settings.DB_POOL_TIMEOUT}s')
+    elif strategy == 'persistent':
+        details = f'CONN_MAX_AGE={database["CONN_MAX_AGE"]}s'
+    else:
+        details = 'new connection for every request'
+    health_checks = (
+        f'after {settings.DB_CONN_HEALTH_CHECK_AGE}s idle'
+        if settings.DB_CONN_HEALTH_CHECKS else 'off'
+    )
+    return (
+        f'Database connections: {strategy} ({details}, health checks '
+        f'{health_checks}); engine {database["ENGINE"]}; gunicorn worker '
+        f'class {os.getenv("GUNICORN_WORKER_CLASS", "sync")}, '
+        f'{os.getenv("GUNICORN_THREADS", "1")} threads.'
+    )
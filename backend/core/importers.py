@@ -0,0 +1,218 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models, transaction
+
+from core.signals import catalog_changed
+
+DEFAULT_IMPORT_FOLDER_NAME = 'data'
+DEFAULT_IMPORT_FILE_PATH = os.path.join(
+    settings.BASE_DIR, DEFAULT_IMPORT_FOLDER_NAME,
+)
+DEFAULT_BATCH_SIZE = 1000
+JSON_CHUNK_SIZE = 64 * 1024
+
+MSG_SUCCESSFUL = 'Import completed successfully!'
+MSG_UNSUCCESSFUL = 'Import failed...'
+MSG_NO_CHANGES = 'No changes detected.'
+MSG_DRY_RUN = 'Dry run: {} rows would be added.'
+MSG_PROGRESS = '{} rows processed, {} new.'
+MSG_TIMING = 'Finished in {:.2f}s.'
+
+ERR_FILE_NOT_EXISTS = (
+    "File with name '{}' in folder '{}' is required!"
+)
+ERR_ARGS_FILE_NOT_EXISTS = ("There is no such file as '{}'")
+ERR_INVALID_ROW = "Row {}: expected {} values, got {!r}"
+ERR_INVALID_JSON = "Invalid JSON: {}"
+ERR_INVALID_BATCH_SIZE = "--batch-size must be a positive integer, got {}"
+ERR_NOT_JSON_ARRAY = "expected an array of objects"
+
+
+def iter_json_array(file, chunk_size=JSON_CHUNK_SIZE):
+    """Yield the items of a top-level JSON array read in chunks."""
+    decoder = json.JSONDecoder()
+    buffer, eof = '', False
+    started = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started and buffer:
+            if buffer[0] != '[':
+                raise json.JSONDecodeError(ERR_NOT_JSON_ARRAY, buffer, 0)
+            buffer, started = buffer[1:], True
+            continue
+        if started and buffer.startswith(']'):
+            return
+        if started and buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        item = end = None
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+        # A value ending with the buffer (e.g. a number) may be cut off.
+        if end is None or (end == len(buffer) and not eof):
+            if eof:
+                raise json.JSONDecodeError(
+                    ERR_NOT_JSON_ARRAY, buffer, len(buffer),
+                )
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+class BaseImportCommand(BaseCommand):
+    """Batched catalog import from a CSV, JSON array or JSON Lines file.
+
+    Files are read incrementally. Rows are read in batches, checked
+    against every unique key of the model already stored (fetched with
+    one query per key) and inserted with `bulk_create` inside one
+    transaction, so the reported count is the number of rows inserted.
+    """
+    model = None
+    fields = ()
+    default_filename = None
+
+    def add_arguments(self, parser):
+        parser.add_argument('-f', '--filename', dest='filename',
+                            default=self.default_filename, nargs='?',
+                            type=str,
+                            help='specify file name (CSV, JSON or JSONL).')
+        parser.add_argument('--batch-size', type=int,
+                            default=DEFAULT_BATCH_SIZE,
+                            help='number of rows per INSERT.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only count new rows, do not write them.')
+
+    def read_rows(self, file, extension):
+        if extension in ('.json', '.jsonl'):
+            items = (
+                iter_json_array(file) if extension == '.json'
+                else (json.loads(line) for line in file if line.strip())
+            )
+            for number, item in enumerate(items, start=1):
+                try:
+                    yield tuple(item[field] for field in self.fields)
+                except (KeyError, TypeError):
+                    raise CommandError(ERR_INVALID_ROW.format(
+                        number, len(self.fields), item,
+                    ))
+            return
+        for number, row in enumerate(csv.reader(file), start=1):
+            if len(row) != len(self.fields):
+                raise CommandError(
+                    ERR_INVALID_ROW.format(number, len(self.fields), row)
+                )
+            yield tuple(row)
+
+    def get_unique_keys(self):
+        """Field tuples of the unique constraints covered by `fields`."""
+        opts = self.model._meta
+        keys = [
+            (field.name,) for field in opts.fields
+            if field.unique and not field.primary_key
+        ]
+        keys += [
+            tuple(constraint.fields) for constraint in opts.constraints
+            if isinstance(constraint, models.UniqueConstraint)
+            and constraint.condition is None
+        ]
+        keys += [tuple(fields) for fields in opts.unique_together]
+        keys = [key for key in keys if set(key) <= set(self.fields)]
+        return keys or [tuple(self.fields)]
+
+    def import_rows(self, rows, batch_size, dry_run):
+        positions = {
+            key: [self.fields.index(field) for field in key]
+            for key in self.get_unique_keys()
+        }
+        processed = created = 0
+        with transaction.atomic():
+            existing = {
+                key: set(self.model.objects.values_list(*key))
+                for key in positions
+            }
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                new_objects = []
+                for row in batch:
+                    values = {
+                        key: tuple(row[position] for position in indexes)
+                        for key, indexes in positions.items()
+                    }
+                    if any(
+                        value in existing[key]
+                        for key, value in values.items()
+                    ):
+                        continue
+                    for key, value in values.items():
+                        existing[key].add(value)
+                    new_objects.append(
+                        self.model(**dict(zip(self.fields, row)))
+                    )
+                if not dry_run:
+                    self.model.objects.bulk_create(
+                        new_objects, ignore_conflicts=True,
+                    )
+                processed += len(batch)
+                created += len(new_objects)
+                self.stdout.write(MSG_PROGRESS.format(processed, created))
+        return created
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError(
+                ERR_INVALID_BATCH_SIZE.format(options['batch_size'])
+            )
+        path_to_file = os.path.join(
+            DEFAULT_IMPORT_FILE_PATH,
+            options['filename'] or self.default_filename,
+        )
+        started = time.perf_counter()
+        try:
+            with open(file=path_to_file,
+                      mode='r',
+                      encoding='utf-8') as file:
+                count_rows = self.import_rows(
+                    self.read_rows(file, os.path.splitext(path_to_file)[1]),
+                    options['batch_size'],
+                    options['dry_run'],
+                )
+        except FileNotFoundError:
+            self.stdout.write(self.style.ERROR(MSG_UNSUCCESSFUL))
+            if options['filename']:
+                self.stdout.write(self.style.ERROR(
+                    ERR_ARGS_FILE_NOT_EXISTS.format(options['filename'])
+                ))
+                return
+            raise CommandError(ERR_FILE_NOT_EXISTS.format(
+                self.default_filename, DEFAULT_IMPORT_FOLDER_NAME,
+            ))
+        except json.JSONDecodeError as error:
+            raise CommandError(ERR_INVALID_JSON.format(error))
+        if options['dry_run']:
+            self.stdout.write(self.style.NOTICE(
+                MSG_DRY_RUN.format(count_rows)
+            ))
+        elif count_rows == 0:
+            self.stdout.write(self.style.NOTICE(MSG_NO_CHANGES))
+        else:
+            # bulk_create does not send post_save, so notify the caches.
+            catalog_changed.send(sender=self.model)
+            self.stdout.write(self.style.SUCCESS(
+                MSG_SUCCESSFUL + f' {count_rows} rows added.'
+            ))
+        self.stdout.write(MSG_TIMING.format(time.perf_counter() - started))
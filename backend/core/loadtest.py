@@ -0,0 +1,27 @@
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import RequestFactory
+
+# django.test.Client keeps connections open between requests, so load
+# tests call the real handlers, which run close_old_connections.
+_factory = RequestFactory()
+
+
+def wsgi_get(handler, path, headers=None):
+    """GET `path` through a WSGIHandler and return the status code."""
+    status = []
+    environ = _factory.get(path, **(headers or {})).environ
+
+    def start_response(status_line, response_headers, exc_info=None):
+        status.append(int(status_line.split()[0]))
+
+    response = handler(environ, start_response)
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0]
+
+
+def get_wsgi_handler():
+    return WSGIHandler()
@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent with the model class as sender after bulk catalog changes that
+# bypass post_save (e.g. bulk_create in the import commands).
+catalog_changed = Signal()
+
+# Sent with `recipe_ids` after recipe rows change without post_save
+# (e.g. queryset.update() in the image worker).
+recipes_changed = Signal()
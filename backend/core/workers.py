@@ -0,0 +1,48 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPool:
+    """Thread pool for work that runs after the response is sent.
+
+    The number of threads is read from the `workers_setting` setting;
+    with 0 the tasks run inline. Tasks queued in the pool are lost if
+    the process exits, so every task needs a command that catches up.
+    """
+
+    def __init__(self, name, workers_setting):
+        self.name = name
+        self.workers_setting = workers_setting
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, self.workers_setting),
+                    thread_name_prefix=self.name,
+                )
+            return self.executor
+
+    def run(self, task, *args):
+        try:
+            task(*args)
+        except Exception:
+            logger.exception('%s: task %s%r failed', self.name,
+                             task.__name__, args)
+        finally:
+            # Worker threads open their own connections.
+            connections.close_all()
+
+    def submit(self, task, *args):
+        if getattr(settings, self.workers_setting) > 0:
+            self.get_executor().submit(self.run, task, *args)
+        else:
+            task(*args)
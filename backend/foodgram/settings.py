@@ -65,19 +65,58 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# Database connections: 'persistent' keeps a connection per worker thread
+# for DB_CONN_MAX_AGE seconds, 'pool' shares DB_POOL_SIZE connections
+# between the threads of a process (for threaded gunicorn workers),
+# 'per-request' opens a new connection for every request
+DB_CONNECTION_STRATEGY = os.getenv('DB_CONNECTION_STRATEGY', 'persistent')
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+DB_CONN_HEALTH_CHECKS = (
+    os.getenv('DB_CONN_HEALTH_CHECKS', 'True').lower() == 'true'
+)
+# Only connections idle for longer than this many seconds are pinged
+DB_CONN_HEALTH_CHECK_AGE = int(os.getenv('DB_CONN_HEALTH_CHECK_AGE', 30))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': (
+            'core.backends.postgresql_pool'
+            if DB_CONNECTION_STRATEGY == 'pool'
+            else 'django.db.backends.postgresql'
+        ),
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': (
+            DB_CONN_MAX_AGE if DB_CONNECTION_STRATEGY == 'persistent' else 0
+        ),
     }
 }
 
 AUTH_USER_MODEL = 'users.User'
 
+# Catalog and response caches. docker-compose runs Memcached
+# (CACHE_BACKEND=django.core.cache.backends.memcached.PyMemcacheCache,
+# CACHE_LOCATION=cache:11211) so invalidation reaches every gunicorn
+# worker. With the per-process LocMemCache and GUNICORN_WORKERS > 1 the
+# version-stamped catalog, fragment and response caches are disabled.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+GUNICORN_WORKERS = int(os.getenv('GUNICORN_WORKERS', 1))
+API_CACHE_ENABLED = GUNICORN_WORKERS <= 1 or not CACHES['default'][
+    'BACKEND'
+].endswith('.LocMemCache')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -122,6 +161,71 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 MEDIA_URL = '/media/'
 
+# Page-number pagination count: 'exact' COUNT(*) or 'estimate'
+# (pg_class.reltuples for unfiltered lists, cached counts otherwise)
+PAGINATION_COUNT_MODE = os.getenv('PAGINATION_COUNT_MODE', 'exact')
+PAGINATION_COUNT_CACHE_TTL = int(os.getenv('PAGINATION_COUNT_CACHE_TTL', 60))
+
+# Ingredient autocomplete: 'auto', 'database' or 'memory'
+INGREDIENT_SEARCH_BACKEND = os.getenv('INGREDIENT_SEARCH_BACKEND', 'auto')
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_SEARCH_INDEX_TTL = int(os.getenv('INGREDIENT_SEARCH_INDEX_TTL', 300))
+
+# Recipe full-text search (?search=): 'auto', 'database' (PostgreSQL
+# tsvector) or 'memory' (in-process inverted index, at most
+# RECIPE_SEARCH_MAX_RESULTS matches)
+RECIPE_SEARCH_BACKEND = os.getenv('RECIPE_SEARCH_BACKEND', 'auto')
+RECIPE_SEARCH_CONFIG = os.getenv('RECIPE_SEARCH_CONFIG', 'russian')
+RECIPE_SEARCH_MAX_RESULTS = int(os.getenv('RECIPE_SEARCH_MAX_RESULTS', 1000))
+RECIPE_SEARCH_INDEX_TTL = int(os.getenv('RECIPE_SEARCH_INDEX_TTL', 300))
+
+# Pantry matching: in-process ingredient -> recipes index, updated in
+# place by this process and rebuilt by RECIPE_PANTRY_INDEX_WORKERS
+# threads (0: inline) after another process changed it or the TTL
+RECIPE_PANTRY_INDEX_TTL = int(os.getenv('RECIPE_PANTRY_INDEX_TTL', 300))
+RECIPE_PANTRY_INDEX_WORKERS = int(
+    os.getenv('RECIPE_PANTRY_INDEX_WORKERS', 1)
+)
+RECIPE_PANTRY_MAX_RESULTS = int(os.getenv('RECIPE_PANTRY_MAX_RESULTS', 1000))
+# Recipes found in the rarest pantry ingredients before the more
+# common ones only add to their match counts
+RECIPE_PANTRY_MAX_CANDIDATES = int(
+    os.getenv('RECIPE_PANTRY_MAX_CANDIDATES', 10000)
+)
+
+# Similar recipes stored per recipe by `update_recipe_neighbors`
+RECIPE_SIMILAR_COUNT = int(os.getenv('RECIPE_SIMILAR_COUNT', 10))
+
+# Follower timelines: new recipes are fanned out by TIMELINE_WORKERS
+# threads (0: inline), except for authors with more followers than
+# TIMELINE_FANOUT_MAX_FOLLOWERS, whose recipes are read on request
+TIMELINE_WORKERS = int(os.getenv('TIMELINE_WORKERS', 2))
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv('TIMELINE_FANOUT_MAX_FOLLOWERS', 10000)
+)
+
+# TTF font with Cyrillic glyphs for the PDF shopping list
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+# Anonymous recipe list/detail responses: fresh for the TTL, then served
+# stale for up to RECIPE_RESPONSE_STALE_TTL seconds while one request
+# renders them again
+RECIPE_RESPONSE_CACHE_TTL = int(os.getenv('RECIPE_RESPONSE_CACHE_TTL', 30))
+RECIPE_RESPONSE_STALE_TTL = int(os.getenv('RECIPE_RESPONSE_STALE_TTL', 60))
+
+# Recipe image variants: worker threads per process (0 processes the
+# image right after the request transaction commits) and output format
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', 2))
+RECIPE_IMAGE_FORMAT = os.getenv('RECIPE_IMAGE_FORMAT', 'WEBP')
+# Limits for uploaded recipe images: decoded bytes and width * height
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024)
+)
+RECIPE_IMAGE_MAX_PIXELS = int(os.getenv('RECIPE_IMAGE_MAX_PIXELS', 40000000))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -0,0 +1,18 @@
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8090')
+# gunicorn suggests 2 * CPU cores + 1.
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+# 'sync' or 'gthread'; threads > 1 implies gthread.
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 2))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+
+def post_worker_init(worker):
+    # The application is loaded at this point, so settings are ready.
+    from core.db import describe_connection_strategy
+    worker.log.info(describe_connection_strategy())
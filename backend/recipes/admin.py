@@ -3,7 +3,7 @@ from django.template.defaultfilters import truncatechars
 from django.template.loader import render_to_string
 
 from .models import (Cart, Favorite, Follow, Ingredient, IngredientRecipe,
-                     Recipe, Tag)
+                     Recipe, ShoppingListItem, Tag)
 
 
 @admin.register(Tag)
@@ -59,8 +59,8 @@ class RecipeAdmin(admin.ModelAdmin):
         'short_text',
         'author',
         'cooking_time',
-        'in_favorite_count_display',
-        'in_shopping_cart_count_display',
+        'favorites_count',
+        'cart_count',
         'pub_date',
     )
     list_filter = (
@@ -72,19 +72,27 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display_links = ('name',)
     filter_horizontal = ('tags', 'ingredients')
     inlines = (IngredientRecipeAdmin,)
+    readonly_fields = ('favorites_count', 'cart_count')
+
+    def save_related(self, request, form, formsets, change):
+        # The inline ingredients are saved after the recipe itself.
+        recipe = form.instance
+        old_amounts = (
+            ShoppingListItem.objects.get_recipe_amounts(recipe)
+            if change else {}
+        )
+        super().save_related(request, form, formsets, change)
+        ShoppingListItem.objects.change_recipe(
+            recipe,
+            old_amounts,
+            ShoppingListItem.objects.get_recipe_amounts(recipe),
+        )
+        Recipe.objects.filter(pk=form.instance.pk).update_search_vectors()
 
     def short_text(self, obj):
         return truncatechars(obj.text, 150)
     short_text.short_description = 'Описание'
 
-    def in_favorite_count_display(self, obj):
-        return obj.favorites.count()
-    in_favorite_count_display.short_description = 'Добавлено в избранное'
-
-    def in_shopping_cart_count_display(self, obj):
-        return obj.shopping_cart.count()
-    in_shopping_cart_count_display.short_description = 'Добавлено в корзину'
-
 
 admin.site.empty_value_display = 'Не задано'
 
@@ -0,0 +1,97 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, features
+
+from core.signals import recipes_changed
+from core.workers import BackgroundPool
+from .models import Recipe
+
+VARIANTS_FOLDER = 'recipes/images/variants/'
+# Recipe field: (suffix, bounding box)
+IMAGE_VARIANTS = {
+    'image_thumbnail': ('thumb', (320, 320)),
+    'image_feed': ('feed', (960, 960)),
+}
+IMAGE_QUALITY = 82
+
+image_pool = BackgroundPool('recipe-images', 'RECIPE_IMAGE_WORKERS')
+
+
+def get_variant_format():
+    image_format = settings.RECIPE_IMAGE_FORMAT.upper()
+    if image_format == 'WEBP' and not features.check('webp'):
+        return 'JPEG'
+    return image_format
+
+
+def render_variant(image, size, image_format):
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    if image_format == 'JPEG' and variant.mode not in ('RGB', 'L'):
+        variant = variant.convert('RGB')
+    buffer = BytesIO()
+    variant.save(buffer, format=image_format, quality=IMAGE_QUALITY)
+    return buffer.getvalue()
+
+
+def process_recipe_image(recipe_id, image_name):
+    """Store the resized variants of a recipe image.
+
+    The variants are attached only if the recipe still has the same
+    image, otherwise the files are discarded.
+    """
+    image_format = get_variant_format()
+    extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    with default_storage.open(image_name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    variants = {}
+    for field, (suffix, size) in IMAGE_VARIANTS.items():
+        variants[field] = default_storage.save(
+            f'{VARIANTS_FOLDER}{stem}_{suffix}.{extension}',
+            ContentFile(render_variant(image, size, image_format)),
+        )
+    updated = Recipe.objects.filter(pk=recipe_id, image=image_name).update(
+        **variants,
+    )
+    if not updated:
+        for name in variants.values():
+            default_storage.delete(name)
+        return False
+    recipes_changed.send(sender=Recipe, recipe_ids=(recipe_id,))
+    return True
+
+
+def schedule_image_processing(recipe):
+    """Process the recipe image once the current transaction commits.
+
+    Tasks queued in the pool are lost if the process exits; the
+    `process_recipe_images` command picks up such recipes.
+    """
+    recipe_id, image_name = recipe.pk, recipe.image.name
+    transaction.on_commit(lambda: image_pool.submit(
+        process_recipe_image, recipe_id, image_name,
+    ))
+
+
+def schedule_variant_deletion(names):
+    """Delete replaced variant files once the current transaction commits.
+
+    The files stay in place if the transaction rolls back, as the recipe
+    still points to them then.
+    """
+    names = [name for name in names if name]
+    if not names:
+        return
+
+    def delete():
+        for name in names:
+            default_storage.delete(name)
+
+    transaction.on_commit(delete)
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.timeline import fan_out_recipe
+
+MSG_FANNED_OUT = ('Recipes fanned out to timelines: {}; read from the '
+                  'authors: {}.')
+
+
+class Command(BaseCommand):
+    help = ("This command fans out to the follower timelines the recipes "
+            "that are not there yet, e.g. after a lost background task")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipe', dest='recipes', type=int,
+                            action='append',
+                            help='limit to recipe id (can be repeated).')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.filter(in_timelines=False)
+        if options['recipes'] is not None:
+            recipes = recipes.filter(pk__in=options['recipes'])
+        fanned_out = skipped = 0
+        for recipe_id in recipes.values_list('pk', flat=True).iterator():
+            if fan_out_recipe(recipe_id):
+                fanned_out += 1
+            else:
+                skipped += 1
+        self.stdout.write(self.style.SUCCESS(
+            MSG_FANNED_OUT.format(fanned_out, skipped)
+        ))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+MSG_PROCESSED = 'Recipe images processed: {}, failed: {}.'
+MSG_FAILED = 'recipe={}: {}'
+
+
+class Command(BaseCommand):
+    help = ("This command generates the thumbnail and feed variants of "
+            "recipe images that have not been processed yet")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipe', dest='recipes', type=int,
+                            action='append',
+                            help='limit to recipe id (can be repeated).')
+        parser.add_argument('--all', action='store_true',
+                            help='regenerate the existing variants too.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if options['recipes'] is not None:
+            recipes = recipes.filter(pk__in=options['recipes'])
+        if not options['all']:
+            recipes = recipes.filter(Q(image_feed='') | Q(image_thumbnail=''))
+        processed = failed = 0
+        for recipe_id, image_name in recipes.values_list(
+            'pk', 'image',
+        ).iterator():
+            try:
+                process_recipe_image(recipe_id, image_name)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stdout.write(self.style.WARNING(
+                    MSG_FAILED.format(recipe_id, error)
+                ))
+                continue
+            processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            MSG_PROCESSED.format(processed, failed)
+        ))
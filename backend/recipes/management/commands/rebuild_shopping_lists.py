@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.models import ShoppingListItem
+
+MSG_REBUILT = 'Shopping lists rebuilt: {} items.'
+MSG_CONSISTENT = 'Shopping lists are consistent: {} items checked.'
+MSG_MISMATCH = 'user={} ingredient={}: stored {}, expected {}'
+
+ERR_INCONSISTENT = '{} shopping list items are out of sync.'
+
+
+class Command(BaseCommand):
+    help = ("This command rebuilds or verifies materialized shopping lists "
+            "from carts and recipe ingredients")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', dest='users', type=int,
+                            action='append',
+                            help='limit to user id (can be repeated).')
+        parser.add_argument('--verify', action='store_true',
+                            help='only report differences, do not write.')
+
+    def handle(self, *args, **options):
+        user_ids = options['users']
+        if not options['verify']:
+            count = ShoppingListItem.objects.rebuild(user_ids)
+            self.stdout.write(self.style.SUCCESS(MSG_REBUILT.format(count)))
+            return
+        expected = ShoppingListItem.objects.get_source_totals(user_ids)
+        items = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in items.values_list(
+                'user_id', 'ingredient_id', 'total_amount',
+            ).iterator()
+        }
+        mismatches = 0
+        for key in sorted(expected.keys() | stored.keys()):
+            if expected.get(key) != stored.get(key):
+                mismatches += 1
+                self.stdout.write(self.style.WARNING(MSG_MISMATCH.format(
+                    *key, stored.get(key), expected.get(key),
+                )))
+        if mismatches:
+            raise CommandError(ERR_INCONSISTENT.format(mismatches))
+        self.stdout.write(self.style.SUCCESS(
+            MSG_CONSISTENT.format(len(stored))
+        ))
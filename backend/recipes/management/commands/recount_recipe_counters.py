@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+from recipes.models import Recipe
+
+MSG_RECOUNTED = 'Recipe counters recounted: {} recipes.'
+MSG_CONSISTENT = 'Recipe counters are consistent: {} recipes checked.'
+MSG_MISMATCH = 'recipe={}: favorites {} (expected {}), cart {} (expected {})'
+
+ERR_INCONSISTENT = '{} recipes have out of sync counters.'
+
+
+class Command(BaseCommand):
+    help = ("This command recounts or verifies the denormalized favorites "
+            "and shopping cart counters of recipes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipe', dest='recipes', type=int,
+                            action='append',
+                            help='limit to recipe id (can be repeated).')
+        parser.add_argument('--verify', action='store_true',
+                            help='only report differences, do not write.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.all()
+        if options['recipes'] is not None:
+            recipes = recipes.filter(pk__in=options['recipes'])
+        if not options['verify']:
+            count = recipes.recount_counters()
+            self.stdout.write(self.style.SUCCESS(MSG_RECOUNTED.format(count)))
+            return
+        recipes = recipes.with_source_counters()
+        mismatches = recipes.filter(
+            ~Q(favorites_count=F('favorites_total'))
+            | ~Q(cart_count=F('cart_total'))
+        ).order_by('pk').values_list(
+            'pk', 'favorites_count', 'favorites_total',
+            'cart_count', 'cart_total',
+        )
+        count = 0
+        for row in mismatches.iterator():
+            count += 1
+            self.stdout.write(self.style.WARNING(MSG_MISMATCH.format(*row)))
+        if count:
+            raise CommandError(ERR_INCONSISTENT.format(count))
+        self.stdout.write(self.style.SUCCESS(
+            MSG_CONSISTENT.format(recipes.count())
+        ))
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.similarity import (RecipeVectors, chunked,
+                                get_affected_recipe_ids,
+                                get_stale_recipe_ids, store_neighbors)
+
+DEFAULT_CHUNK_SIZE = 500
+
+MSG_UP_TO_DATE = 'Similar recipes are up to date.'
+MSG_LOADED = 'Loaded vectors of {} recipes.'
+MSG_AFFECTED = '{} changed recipes, {} more recipes to refresh.'
+MSG_UPDATED = 'Similar recipes updated: {} recipes, {} neighbors.'
+
+
+class Command(BaseCommand):
+    help = ("This command computes the most similar recipes by ingredients "
+            "and tags, for the recipes changed since the last run or for "
+            "all recipes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='recompute every recipe.')
+        parser.add_argument('--count', type=int,
+                            default=settings.RECIPE_SIMILAR_COUNT,
+                            help='neighbors to store per recipe.')
+        parser.add_argument('--chunk-size', type=int,
+                            default=DEFAULT_CHUNK_SIZE,
+                            help='recipes written per transaction.')
+
+    def handle(self, *args, **options):
+        # Recipes saved while the command runs stay stale for the next run.
+        computed_at = timezone.now()
+        all_ids = set(Recipe.objects.values_list('pk', flat=True))
+        recipe_ids = all_ids if options['all'] else get_stale_recipe_ids()
+        if not recipe_ids:
+            self.stdout.write(self.style.SUCCESS(MSG_UP_TO_DATE))
+            return
+        vectors = RecipeVectors.load()
+        self.stdout.write(MSG_LOADED.format(len(vectors.norms)))
+        # When every recipe is recomputed, nothing else can be affected.
+        if recipe_ids != all_ids:
+            affected_ids = get_affected_recipe_ids(
+                vectors, recipe_ids, options['count'],
+            )
+            self.stdout.write(MSG_AFFECTED.format(
+                len(recipe_ids), len(affected_ids),
+            ))
+            recipe_ids |= affected_ids
+        stored = 0
+        for chunk in chunked(recipe_ids, options['chunk_size']):
+            stored += store_neighbors(
+                vectors, chunk, options['count'], computed_at,
+            )
+        self.stdout.write(self.style.SUCCESS(
+            MSG_UPDATED.format(len(recipe_ids), stored)
+        ))
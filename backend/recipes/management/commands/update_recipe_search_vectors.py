@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from recipes.models import Recipe
+
+BATCH_SIZE = 5000
+
+MSG_UPDATED = 'Recipe search vectors updated: {} recipes.'
+
+ERR_NOT_POSTGRESQL = ('Search vectors are only stored on PostgreSQL, other '
+                      'databases use the in-memory search index.')
+
+
+class Command(BaseCommand):
+    help = ("This command recomputes the full-text search vectors of "
+            "recipes, e.g. after RECIPE_SEARCH_CONFIG changes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipe', dest='recipes', type=int,
+                            action='append',
+                            help='limit to recipe id (can be repeated).')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError(ERR_NOT_POSTGRESQL)
+        recipes = Recipe.objects.order_by('pk')
+        if options['recipes'] is not None:
+            recipes = recipes.filter(pk__in=options['recipes'])
+        count = 0
+        last_id = 0
+        # Batches by primary key keep each UPDATE transaction short.
+        while True:
+            ids = list(recipes.filter(pk__gt=last_id).values_list(
+                'pk', flat=True,
+            )[:BATCH_SIZE])
+            if not ids:
+                break
+            count += Recipe.objects.filter(
+                pk__in=ids,
+            ).update_search_vectors()
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(MSG_UPDATED.format(count)))
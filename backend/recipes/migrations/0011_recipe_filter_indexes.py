@@ -0,0 +1,43 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:01
+
+from django.db import migrations, models
+
+
+def merge_duplicate_tags(apps, schema_editor):
+    """Keep the oldest tag per slug and move the recipes of the others."""
+    Tag = apps.get_model('recipes', 'Tag')
+    RecipeTag = apps.get_model('recipes', 'Recipe').tags.through
+    duplicates = list(Tag.objects.values('slug').annotate(
+        rows=models.Count('id'), first_id=models.Min('id'),
+    ).filter(rows__gt=1).order_by())
+    for row in duplicates:
+        other_ids = list(Tag.objects.filter(slug=row['slug']).exclude(
+            pk=row['first_id'],
+        ).values_list('id', flat=True))
+        for other_id in other_ids:
+            RecipeTag.objects.filter(tag_id=other_id).exclude(
+                recipe_id__in=RecipeTag.objects.filter(
+                    tag_id=row['first_id'],
+                ).values('recipe_id'),
+            ).update(tag_id=row['first_id'])
+        Tag.objects.filter(pk__in=other_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_tags, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='tag',
+            name='slug',
+            field=models.SlugField(help_text='Не более 200 символов. Буквы, цифры и только @/./+/-/_', max_length=200, unique=True, verbose_name='Уникальный слаг'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date'], name='recipe_author_pub_date_idx'),
+        ),
+    ]
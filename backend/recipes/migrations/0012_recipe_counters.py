@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:04
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_recipe_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+
+    def count_related(model_name):
+        model = apps.get_model('recipes', model_name)
+        return Coalesce(
+            models.Subquery(
+                model.objects.filter(recipe=models.OuterRef('pk')).order_by(
+                ).values('recipe').annotate(
+                    total=models.Count('pk'),
+                ).values('total')
+            ),
+            0,
+        )
+
+    Recipe.objects.update(
+        favorites_count=count_related('Favorite'),
+        cart_count=count_related('Cart'),
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_recipe_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в корзину'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлено в избранное'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.RunPython(fill_recipe_counters, migrations.RunPython.noop),
+    ]
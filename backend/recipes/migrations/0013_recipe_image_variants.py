@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_feed',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/images/variants/', verbose_name='Картинка для ленты'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/images/variants/', verbose_name='Миниатюра картинки'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:18
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+INDEX_NAME = 'recipe_search_vector_idx'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'UPDATE recipes_recipe AS recipe SET search_vector = '
+        'setweight(to_tsvector(%(config)s::regconfig, '
+        'COALESCE(recipe.name, \'\')), \'A\') || '
+        'setweight(to_tsvector(%(config)s::regconfig, COALESCE(('
+        'SELECT string_agg(ingredient.name, \' \') '
+        'FROM recipes_ingredientrecipe AS recipe_ingredient '
+        'JOIN recipes_ingredient AS ingredient '
+        'ON ingredient.id = recipe_ingredient.ingredient_id '
+        'WHERE recipe_ingredient.recipe_id = recipe.id'
+        '), \'\')), \'B\') || '
+        'setweight(to_tsvector(%(config)s::regconfig, '
+        'COALESCE(recipe.text, \'\')), \'C\')',
+        {'config': settings.RECIPE_SEARCH_CONFIG},
+    )
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+        f'ON recipes_recipe USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
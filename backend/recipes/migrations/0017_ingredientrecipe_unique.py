@@ -0,0 +1,75 @@
+# Generated by Django 3.2.16 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+MAX_AMOUNT = 32767
+CONSTRAINT = models.UniqueConstraint(
+    fields=('ingredient', 'recipe'), name='unique_ingredient_recipe',
+)
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Keep one row per recipe ingredient, with the summed amount."""
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = IngredientRecipe.objects.filter(
+        recipe__isnull=False,
+    ).values('ingredient_id', 'recipe_id').annotate(
+        rows=models.Count('id'),
+        first_id=models.Min('id'),
+        total=models.Sum('amount'),
+    ).filter(rows__gt=1).order_by()
+    for row in duplicates.iterator():
+        IngredientRecipe.objects.filter(pk=row['first_id']).update(
+            amount=min(row['total'], MAX_AMOUNT),
+        )
+        IngredientRecipe.objects.filter(
+            ingredient_id=row['ingredient_id'], recipe_id=row['recipe_id'],
+        ).exclude(pk=row['first_id']).delete()
+
+
+def add_unique_constraint(apps, schema_editor):
+    # Databases migrated before this constraint moved out of 0008
+    # already have it.
+    model = apps.get_model('recipes', 'IngredientRecipe')
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(
+            cursor, model._meta.db_table,
+        )
+    if CONSTRAINT.name not in constraints:
+        schema_editor.add_constraint(model, CONSTRAINT)
+
+
+def remove_unique_constraint(apps, schema_editor):
+    model = apps.get_model('recipes', 'IngredientRecipe')
+    schema_editor.remove_constraint(model, CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_timeline'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='recipe',
+            options={'ordering': ('-pub_date', 'name'), 'verbose_name': 'Рецепт', 'verbose_name_plural': 'Рецепты'},
+        ),
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop,
+        ),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunPython(
+                    add_unique_constraint, remove_unique_constraint,
+                ),
+            ],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='ingredientrecipe',
+                    constraint=CONSTRAINT,
+                ),
+            ],
+        ),
+    ]
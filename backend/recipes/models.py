@@ -1,6 +1,12 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector, SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce, Greatest
 
 from core.models import BaseNamedModel, BaseRecipeModel
 from core.constants import (MAX_CHARACTER_COUNT,
@@ -8,9 +14,10 @@ from core.constants import (MAX_CHARACTER_COUNT,
                             MIN_VALUE_AMOUNT)
 from .validators import hex_validator
 
-
 User = get_user_model()
 
+UPSERT_BATCH_SIZE = 1000
+
 
 class Tag(BaseNamedModel):
     color = models.CharField(
@@ -22,6 +29,7 @@ class Tag(BaseNamedModel):
     slug = models.SlugField(
         'Уникальный слаг',
         max_length=MAX_CHARACTER_COUNT,
+        unique=True,
         help_text='Не более 200 символов. Буквы, цифры и только @/./+/-/_',
     )
 
@@ -50,6 +58,62 @@ class Ingredient(BaseNamedModel):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    @staticmethod
+    def count_related(model):
+        return Coalesce(
+            models.Subquery(
+                model.objects.filter(recipe=models.OuterRef('pk')).order_by(
+                ).values('recipe').annotate(
+                    total=models.Count('pk'),
+                ).values('total')
+            ),
+            0,
+        )
+
+    def with_source_counters(self):
+        """Annotate the counters computed from favorites and carts."""
+        return self.annotate(
+            favorites_total=self.count_related(Favorite),
+            cart_total=self.count_related(Cart),
+        )
+
+    def recount_counters(self):
+        return self.update(
+            favorites_count=self.count_related(Favorite),
+            cart_count=self.count_related(Cart),
+        )
+
+    @staticmethod
+    def search_vector():
+        """Name (weight A), ingredient names (B) and text (C)."""
+        config = settings.RECIPE_SEARCH_CONFIG
+        ingredient_names = models.Subquery(
+            IngredientRecipe.objects.filter(
+                recipe=models.OuterRef('pk'),
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' '),
+            ).values('names')
+        )
+        return (
+            SearchVector('name', config=config, weight='A')
+            + SearchVector(ingredient_names, config=config, weight='B')
+            + SearchVector('text', config=config, weight='C')
+        )
+
+    def update_search_vectors(self):
+        """Recompute `search_vector`; a no-op outside PostgreSQL."""
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        return self.update(search_vector=self.search_vector())
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            delete_user_lists(self.values_list('pk', flat=True))
+            return super().delete()
+
+
 class Recipe(models.Model):
     tags = models.ManyToManyField(
         Tag,
@@ -76,6 +140,18 @@ class Recipe(models.Model):
         'Ссылка на картинку на сайте',
         upload_to='recipes/images/',
     )
+    image_feed = models.ImageField(
+        'Картинка для ленты',
+        upload_to='recipes/images/variants/',
+        blank=True,
+        editable=False,
+    )
+    image_thumbnail = models.ImageField(
+        'Миниатюра картинки',
+        upload_to='recipes/images/variants/',
+        blank=True,
+        editable=False,
+    )
     text = models.TextField(
         'Описание',
         help_text='Описание способа приготовления блюда',
@@ -88,15 +164,161 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True,
     )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлено в избранное',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        'Добавлено в корзину',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+    neighbors_updated_at = models.DateTimeField(
+        'Дата расчёта похожих рецептов',
+        null=True,
+        editable=False,
+    )
+    in_timelines = models.BooleanField(
+        'Разослан в ленты подписчиков',
+        default=False,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date', 'name')
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=('author', '-pub_date'),
+                name='recipe_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=('-favorites_count', '-id'),
+                name='recipe_favorites_count_idx',
+            ),
+            # Recipes the timelines read from the authors directly.
+            models.Index(
+                fields=('author', '-id'),
+                name='recipe_not_in_timelines_idx',
+                condition=models.Q(in_timelines=False),
+            ),
+        )
 
     def __str__(self):
         return self.name
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            delete_user_lists((self.pk,))
+            return super().delete(*args, **kwargs)
+
+
+def delete_user_lists(recipe_ids):
+    """Delete the favorites and carts of recipes about to be deleted.
+
+    A statement per table instead of the cascade, which sends signals
+    and so updates the counters and the shopping list once per row.
+    """
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        Favorite.objects.delete_for_recipes(recipe_ids)
+        Cart.objects.delete_for_recipes(recipe_ids)
+
+
+class TimelineEntry(models.Model):
+    """Recipe of a followed author, fanned out to a follower's timeline.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        indexes = (
+            models.Index(
+                fields=('user', 'author'),
+                name='timeline_user_author_idx',
+            ),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                name='unique_timeline_entry',
+                fields=('user', 'recipe'),
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe} в ленте пользователя {self.user}.'
+
+
+class RecipeNeighbor(models.Model):
+    """Precomputed similar recipe, see `recipes.similarity`."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='neighbors',
+        verbose_name='Рецепт',
+    )
+    neighbor = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        indexes = (
+            models.Index(
+                fields=('recipe', '-score'),
+                name='recipe_neighbor_score_idx',
+            ),
+        )
+        constraints = (
+            models.UniqueConstraint(
+                name='unique_recipe_neighbor',
+                fields=('recipe', 'neighbor'),
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.neighbor} похож на {self.recipe} ({self.score:.2f}).'
+
 
 class IngredientRecipe(models.Model):
     ingredient = models.ForeignKey(
@@ -128,8 +350,130 @@ class IngredientRecipe(models.Model):
                 f'— добавлено в рецепт "{self.recipe.name.capitalize()}".')
 
 
+class UserRecipeManager(models.Manager):
+    """Set-based writes of a user's favorites or cart.
+
+    One INSERT ... ON CONFLICT DO NOTHING or DELETE statement handles
+    any number of recipes and, with RETURNING, reports the rows it
+    actually changed, so neither existence nor uniqueness is checked
+    beforehand. Ids of missing recipes are skipped. No model signals are
+    sent: the recipe counters (`counter_field`) are updated here.
+    Requires PostgreSQL or SQLite 3.35+.
+    """
+    counter_field = None
+
+    def get_columns(self):
+        quote = connections[self.db].ops.quote_name
+        opts = self.model._meta
+        return (
+            quote(opts.db_table),
+            quote(opts.get_field('user').column),
+            quote(opts.get_field('recipe').column),
+        )
+
+    def execute_returning(self, sql, params):
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def change_counters(self, recipe_ids, delta):
+        field = self.counter_field
+        recipes = Recipe.objects.filter(pk__in=recipe_ids)
+        if delta < 0:
+            recipes = recipes.filter(**{f'{field}__gt': 0})
+        recipes.update(**{field: models.F(field) + delta})
+
+    def add_recipes(self, user_id, recipe_ids):
+        """Add the recipes, return the ids of those that were not there.
+        """
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return []
+        table, user_column, recipe_column = self.get_columns()
+        recipe_table = connections[self.db].ops.quote_name(
+            Recipe._meta.db_table,
+        )
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with transaction.atomic(using=self.db):
+            added = [row[0] for row in self.execute_returning(
+                f'INSERT INTO {table} ({user_column}, {recipe_column}) '
+                f'SELECT %s, id FROM {recipe_table} '
+                f'WHERE id IN ({placeholders}) '
+                f'ON CONFLICT DO NOTHING RETURNING {recipe_column}',
+                [user_id, *recipe_ids],
+            )]
+            if added:
+                self.change_counters(added, 1)
+                self.recipes_added(user_id, added)
+        return added
+
+    def remove_recipes(self, user_id, recipe_ids):
+        """Remove the recipes, return the ids of those that were there.
+        """
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return []
+        table, user_column, recipe_column = self.get_columns()
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        with transaction.atomic(using=self.db):
+            removed = [row[0] for row in self.execute_returning(
+                f'DELETE FROM {table} WHERE {user_column} = %s '
+                f'AND {recipe_column} IN ({placeholders}) '
+                f'RETURNING {recipe_column}',
+                [user_id, *recipe_ids],
+            )]
+            if removed:
+                self.change_counters(removed, -1)
+                self.recipes_removed(user_id, removed)
+        return removed
+
+    def delete_for_recipes(self, recipe_ids):
+        """Delete every row of the recipes, which are being deleted.
+
+        The counters of the recipes are left as they are.
+        """
+        table, user_column, recipe_column = self.get_columns()
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        rows = self.execute_returning(
+            f'DELETE FROM {table} WHERE {recipe_column} IN ({placeholders}) '
+            f'RETURNING {user_column}, {recipe_column}',
+            recipe_ids,
+        )
+        if rows:
+            self.rows_deleted(rows)
+        return rows
+
+    def recipes_added(self, user_id, recipe_ids):
+        pass
+
+    def recipes_removed(self, user_id, recipe_ids):
+        pass
+
+    def rows_deleted(self, rows):
+        pass
+
+
+class FavoriteManager(UserRecipeManager):
+    counter_field = 'favorites_count'
+
+
+class CartManager(UserRecipeManager):
+    counter_field = 'cart_count'
+
+    def recipes_added(self, user_id, recipe_ids):
+        ShoppingListItem.objects.add_recipes(user_id, recipe_ids)
+
+    def recipes_removed(self, user_id, recipe_ids):
+        ShoppingListItem.objects.remove_recipes(user_id, recipe_ids)
+
+    def rows_deleted(self, rows):
+        ShoppingListItem.objects.remove_carts(rows)
+
+
 class Cart(BaseRecipeModel):
 
+    objects = CartManager()
+
     class Meta(BaseRecipeModel.Meta):
         default_related_name = 'shopping_cart'
         verbose_name = "Список покупок"
@@ -140,8 +484,238 @@ class Cart(BaseRecipeModel):
                 f'в корзине у пользователя {self.user}.')
 
 
+class ShoppingListManager(models.Manager):
+    """Incrementally maintained shopping list totals.
+
+    Cart changes, recipe edits through the API and the admin, and
+    recipe deletions keep the totals in step. Ingredient rows changed
+    any other way (shell, raw SQL, data migrations) leave them stale
+    until `rebuild` runs for the users concerned.
+    """
+
+    @staticmethod
+    def get_recipe_amounts(recipe):
+        return dict(
+            IngredientRecipe.objects.filter(recipe=recipe).values_list(
+                'ingredient_id', 'amount',
+            )
+        )
+
+    def apply_changes(self, user_ids, changes):
+        """Add `changes` ({ingredient_id: amount}) to the users' lists.
+
+        Increases are one INSERT ... ON CONFLICT DO UPDATE, so that two
+        concurrent cart writes of a user never insert the same item
+        twice. Decreases are one UPDATE clamped at zero, the items that
+        reach zero are then deleted. Requires PostgreSQL or SQLite 3.24+.
+        """
+        user_ids = list(user_ids)
+        increases = {
+            ingredient_id: amount
+            for ingredient_id, amount in changes.items() if amount > 0
+        }
+        decreases = {
+            ingredient_id: -amount
+            for ingredient_id, amount in changes.items() if amount < 0
+        }
+        if not user_ids or not (increases or decreases):
+            return
+        with transaction.atomic(using=self.db, savepoint=False):
+            if increases:
+                self.add_amounts(user_ids, increases)
+            if decreases:
+                items = self.filter(
+                    user_id__in=user_ids, ingredient_id__in=decreases,
+                )
+                items.update(total_amount=Greatest(
+                    models.F('total_amount') - models.Case(
+                        *(
+                            models.When(
+                                ingredient_id=ingredient_id, then=amount,
+                            )
+                            for ingredient_id, amount in decreases.items()
+                        ),
+                        output_field=models.PositiveIntegerField(),
+                    ),
+                    0,
+                ))
+                items.filter(total_amount=0).delete()
+
+    def add_amounts(self, user_ids, amounts):
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        opts = self.model._meta
+        table = quote(opts.db_table)
+        user_column = quote(opts.get_field('user').column)
+        ingredient_column = quote(opts.get_field('ingredient').column)
+        total_column = quote(opts.get_field('total_amount').column)
+        rows = [
+            (user_id, ingredient_id, amount)
+            for user_id in user_ids
+            for ingredient_id, amount in amounts.items()
+        ]
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), UPSERT_BATCH_SIZE):
+                batch = rows[start:start + UPSERT_BATCH_SIZE]
+                cursor.execute(
+                    f'INSERT INTO {table} '
+                    f'({user_column}, {ingredient_column}, {total_column}) '
+                    f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                    f'ON CONFLICT ({user_column}, {ingredient_column}) '
+                    f'DO UPDATE SET {total_column} = '
+                    f'{table}.{total_column} + EXCLUDED.{total_column}',
+                    [value for row in batch for value in row],
+                )
+
+    def add_recipe(self, user_id, recipe):
+        self.apply_changes((user_id,), self.get_recipe_amounts(recipe))
+
+    def remove_recipe(self, user_id, recipe):
+        self.apply_changes(
+            (user_id,),
+            {
+                ingredient_id: -amount
+                for ingredient_id, amount
+                in self.get_recipe_amounts(recipe).items()
+            },
+        )
+
+    @staticmethod
+    def get_recipes_amounts(recipe_ids):
+        return dict(
+            IngredientRecipe.objects.filter(
+                recipe_id__in=recipe_ids,
+            ).values('ingredient_id').annotate(
+                total=models.Sum('amount'),
+            ).order_by().values_list('ingredient_id', 'total')
+        )
+
+    def add_recipes(self, user_id, recipe_ids):
+        self.apply_changes((user_id,), self.get_recipes_amounts(recipe_ids))
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.apply_changes(
+            (user_id,),
+            {
+                ingredient_id: -amount
+                for ingredient_id, amount
+                in self.get_recipes_amounts(recipe_ids).items()
+            },
+        )
+
+    def remove_carts(self, carts):
+        """Subtract the recipes of deleted (user id, recipe id) carts."""
+        recipes_by_user = defaultdict(set)
+        for user_id, recipe_id in carts:
+            recipes_by_user[user_id].add(recipe_id)
+        users_by_recipes = defaultdict(list)
+        for user_id, recipe_ids in recipes_by_user.items():
+            users_by_recipes[frozenset(recipe_ids)].append(user_id)
+        for recipe_ids, user_ids in users_by_recipes.items():
+            self.apply_changes(
+                user_ids,
+                {
+                    ingredient_id: -amount
+                    for ingredient_id, amount
+                    in self.get_recipes_amounts(recipe_ids).items()
+                },
+            )
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Propagate new ingredient amounts of a recipe to every cart."""
+        changes = {
+            ingredient_id: (
+                new_amounts.get(ingredient_id, 0)
+                - old_amounts.get(ingredient_id, 0)
+            )
+            for ingredient_id in {*old_amounts, *new_amounts}
+        }
+        self.apply_changes(
+            Cart.objects.filter(recipe=recipe).values_list(
+                'user_id', flat=True,
+            ),
+            changes,
+        )
+
+    def get_source_totals(self, user_ids=None):
+        """Aggregate the totals from carts and recipe ingredients."""
+        queryset = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False,
+        )
+        if user_ids is not None:
+            queryset = queryset.filter(
+                recipe__shopping_cart__user_id__in=user_ids,
+            )
+        return {
+            (row['user_id'], row['ingredient_id']): row['total_amount']
+            for row in queryset.values(
+                'ingredient_id',
+                user_id=models.F('recipe__shopping_cart__user_id'),
+            ).annotate(
+                total_amount=models.Sum('amount'),
+            ).order_by().iterator()
+        }
+
+    def rebuild(self, user_ids=None):
+        totals = self.get_source_totals(user_ids)
+        with transaction.atomic():
+            items = self.all()
+            if user_ids is not None:
+                items = items.filter(user_id__in=user_ids)
+            items.delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        total_amount=total_amount,
+                    )
+                    for (user_id, ingredient_id), total_amount
+                    in totals.items()
+                ),
+                batch_size=1000,
+            )
+        return len(totals)
+
+
+class ShoppingListItem(models.Model):
+    """Materialized shopping list: ingredient totals of a user's cart."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.PositiveIntegerField(
+        'Общее количество',
+    )
+
+    objects = ShoppingListManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списков покупок'
+        constraints = (
+            models.UniqueConstraint(
+                name='unique_shopping_list_item',
+                fields=('user', 'ingredient'),
+            ),
+        )
+
+    def __str__(self):
+        return (f'{self.ingredient} — {self.total_amount} '
+                f'в списке покупок пользователя {self.user}.')
+
+
 class Favorite(BaseRecipeModel):
 
+    objects = FavoriteManager()
+
     class Meta(BaseRecipeModel.Meta):
         default_related_name = 'favorites'
         verbose_name = 'Избранный рецепт'
@@ -171,6 +745,12 @@ class Follow(models.Model):
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        indexes = (
+            models.Index(
+                fields=('user', 'id'),
+                name='follow_user_id_idx',
+            ),
+        )
         constraints = (
             models.UniqueConstraint(
                 name='unique_following',
@@ -0,0 +1,87 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import (Cart, Favorite, Follow, Ingredient, Recipe,
+                     RecipeNeighbor, ShoppingListItem, TimelineEntry)
+from .timeline import schedule_backfill, schedule_fan_out
+
+COUNTER_FIELDS = {
+    Favorite: 'favorites_count',
+    Cart: 'cart_count',
+}
+
+
+@receiver(post_save, sender=Cart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipe(
+            instance.user_id, instance.recipe_id,
+        )
+
+
+@receiver(pre_delete, sender=Cart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    # Recipe deletion removes its carts itself (delete_user_lists), in
+    # one statement; this covers single carts and user deletion.
+    ShoppingListItem.objects.remove_recipe(
+        instance.user_id, instance.recipe_id,
+    )
+
+
+def change_counter(instance, field, delta):
+    recipes = Recipe.objects.filter(pk=instance.recipe_id)
+    if delta < 0:
+        recipes = recipes.filter(**{f'{field}__gt': 0})
+    recipes.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Cart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    if created:
+        change_counter(instance, COUNTER_FIELDS[sender], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Cart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    change_counter(instance, COUNTER_FIELDS[sender], -1)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            ingredients=instance,
+        ).update_search_vectors()
+
+
+@receiver(pre_delete, sender=Recipe)
+def mark_neighbors_stale(sender, instance, **kwargs):
+    # The recipes listing this one lose a neighbor: have the next
+    # `update_recipe_neighbors` run recompute their lists.
+    Recipe.objects.filter(
+        pk__in=RecipeNeighbor.objects.filter(
+            neighbor=instance,
+        ).values('recipe_id'),
+    ).update(neighbors_updated_at=None)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        schedule_fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def add_to_timeline(sender, instance, created, **kwargs):
+    if created:
+        schedule_backfill(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def remove_from_timeline(sender, instance, **kwargs):
+    TimelineEntry.objects.filter(
+        user_id=instance.user_id, author_id=instance.following_id,
+    ).delete()
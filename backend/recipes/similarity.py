@@ -0,0 +1,146 @@
+import heapq
+import math
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+
+from .models import IngredientRecipe, Recipe, RecipeNeighbor
+
+TAG_WEIGHT = 0.5
+# Ingredients used by more recipes than this share (salt, water...) do
+# not make recipes candidates on their own.
+FREQUENT_INGREDIENT_SHARE = 0.05
+MIN_FREQUENT_INGREDIENT_RECIPES = 1000
+
+
+class RecipeVectors:
+    """Sparse binary recipe vectors over ingredients and tags.
+
+    Ingredients weigh 1 and tags TAG_WEIGHT. The cosine similarity of a
+    recipe is computed only against candidates that share one of its
+    ingredients, found through the ingredient -> recipes `postings`;
+    frequent ingredients and tags still add to the score of a candidate
+    but do not make one, which keeps a run far from quadratic.
+    """
+
+    def __init__(self):
+        self.ingredients = defaultdict(set)
+        self.tags = defaultdict(set)
+        self.postings = defaultdict(list)
+        self.norms = {}
+        self.frequent = MIN_FREQUENT_INGREDIENT_RECIPES
+
+    @classmethod
+    def load(cls):
+        vectors = cls()
+        rows = IngredientRecipe.objects.filter(
+            recipe__isnull=False,
+        ).values_list('recipe_id', 'ingredient_id')
+        for recipe_id, ingredient_id in rows.iterator():
+            vectors.ingredients[recipe_id].add(ingredient_id)
+            vectors.postings[ingredient_id].append(recipe_id)
+        rows = Recipe.tags.through.objects.values_list('recipe_id', 'tag_id')
+        for recipe_id, tag_id in rows.iterator():
+            vectors.tags[recipe_id].add(tag_id)
+        for recipe_id in vectors.ingredients.keys() | vectors.tags.keys():
+            vectors.norms[recipe_id] = math.sqrt(
+                len(vectors.ingredients[recipe_id])
+                + TAG_WEIGHT ** 2 * len(vectors.tags[recipe_id])
+            )
+        vectors.frequent = max(
+            MIN_FREQUENT_INGREDIENT_RECIPES,
+            FREQUENT_INGREDIENT_SHARE * len(vectors.norms),
+        )
+        return vectors
+
+    def get_candidates(self, recipe_id):
+        postings = sorted(
+            (self.postings[ingredient_id]
+             for ingredient_id in self.ingredients.get(recipe_id, ())),
+            key=len,
+        )
+        candidates = set()
+        for index, posting in enumerate(postings):
+            # The rarest ingredient is used even when it is frequent.
+            if index and len(posting) > self.frequent:
+                break
+            candidates.update(posting)
+        candidates.discard(recipe_id)
+        return candidates
+
+    def similarities(self, recipe_id):
+        """Return {recipe id: cosine similarity} of the candidate recipes.
+        """
+        ingredients = self.ingredients.get(recipe_id, set())
+        tags = self.tags.get(recipe_id, set())
+        norm = self.norms.get(recipe_id)
+        return {
+            other_id: (
+                len(ingredients & self.ingredients[other_id])
+                + TAG_WEIGHT ** 2 * len(tags & self.tags[other_id])
+            ) / (norm * self.norms[other_id])
+            for other_id in self.get_candidates(recipe_id)
+        }
+
+
+def top_neighbors(similarities, count):
+    return heapq.nlargest(
+        count, similarities.items(), key=lambda item: (item[1], item[0]),
+    )
+
+
+def get_stale_recipe_ids():
+    """Recipes changed since their neighbors were computed."""
+    return set(Recipe.objects.filter(
+        Q(neighbors_updated_at__isnull=True)
+        | Q(updated_at__gt=F('neighbors_updated_at'))
+    ).values_list('pk', flat=True))
+
+
+def get_affected_recipe_ids(vectors, recipe_ids, count):
+    """Recipes whose neighbor lists may change because of `recipe_ids`.
+
+    Similarity is symmetric, so a changed recipe can only enter the list
+    of a recipe it is now more similar to than that list's weakest
+    entry, or leave (or move within) the list of a recipe that holds it.
+    """
+    weakest = {
+        row['recipe']: (row['total'], row['weakest'])
+        for row in RecipeNeighbor.objects.values('recipe').annotate(
+            total=Count('pk'), weakest=Min('score'),
+        ).order_by()
+    }
+    affected = set(RecipeNeighbor.objects.filter(
+        neighbor_id__in=recipe_ids,
+    ).values_list('recipe_id', flat=True))
+    for recipe_id in recipe_ids:
+        for other_id, score in vectors.similarities(recipe_id).items():
+            total, weakest_score = weakest.get(other_id, (0, 0))
+            if total < count or score > weakest_score:
+                affected.add(other_id)
+    return affected - set(recipe_ids)
+
+
+def store_neighbors(vectors, recipe_ids, count, computed_at):
+    rows = [
+        RecipeNeighbor(recipe_id=recipe_id, neighbor_id=other_id, score=score)
+        for recipe_id in recipe_ids
+        for other_id, score in top_neighbors(
+            vectors.similarities(recipe_id), count,
+        )
+    ]
+    with transaction.atomic():
+        RecipeNeighbor.objects.filter(recipe_id__in=recipe_ids).delete()
+        RecipeNeighbor.objects.bulk_create(rows)
+        # QuerySet.update() does not bump the auto_now updated_at.
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            neighbors_updated_at=computed_at,
+        )
+    return len(rows)
+
+
+def chunked(items, size):
+    items = sorted(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
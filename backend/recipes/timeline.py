@@ -0,0 +1,116 @@
+from django.conf import settings
+from django.db import transaction
+
+from core.workers import BackgroundPool
+from .models import Follow, Recipe, TimelineEntry
+
+FANOUT_BATCH_SIZE = 1000
+
+timeline_pool = BackgroundPool('timeline', 'TIMELINE_WORKERS')
+
+
+def fans_out(author_id):
+    """Whether the author's recipes are written to the timelines.
+
+    Recipes of authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS
+    followers stay `in_timelines=False` and are read from the author
+    when a timeline is requested (fan-out on read).
+    """
+    return Follow.objects.filter(following_id=author_id).count() <= (
+        settings.TIMELINE_FANOUT_MAX_FOLLOWERS
+    )
+
+
+def fan_out_recipe(recipe_id):
+    """Insert the recipe into the timelines of its author's followers."""
+    author_id = Recipe.objects.filter(pk=recipe_id).values_list(
+        'author_id', flat=True,
+    ).first()
+    if author_id is None or not fans_out(author_id):
+        return False
+    followers = Follow.objects.filter(following_id=author_id).order_by(
+        'user_id',
+    ).values_list('user_id', flat=True)
+    last_user_id = 0
+    while True:
+        user_ids = list(
+            followers.filter(user_id__gt=last_user_id)[:FANOUT_BATCH_SIZE]
+        )
+        if not user_ids:
+            break
+        TimelineEntry.objects.bulk_create(
+            (
+                TimelineEntry(
+                    user_id=user_id, recipe_id=recipe_id, author_id=author_id,
+                )
+                for user_id in user_ids
+            ),
+            ignore_conflicts=True,
+        )
+        last_user_id = user_ids[-1]
+    Recipe.objects.filter(pk=recipe_id).update(in_timelines=True)
+    return True
+
+
+def backfill_timeline(user_id, author_id):
+    """Add the fanned out recipes of a newly followed author.
+
+    This does not depend on `fans_out`: the recipes fanned out before
+    the author crossed the threshold are `in_timelines=True` and are not
+    read from the author, whatever the number of followers is now.
+    """
+    following = Follow.objects.filter(
+        user_id=user_id, following_id=author_id,
+    ).exists()
+    if not following:
+        return
+    recipe_ids = Recipe.objects.filter(
+        author_id=author_id, in_timelines=True,
+    ).values_list('pk', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id, recipe_id=recipe_id, author_id=author_id,
+            )
+            for recipe_id in recipe_ids.iterator()
+        ),
+        batch_size=FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def schedule_fan_out(recipe):
+    """Fan the recipe out once the current transaction commits.
+
+    Until then, and if the task is lost, the recipe is still read from
+    its author (`in_timelines=False`); the `fan_out_timelines` command
+    catches up.
+    """
+    recipe_id = recipe.pk
+    transaction.on_commit(
+        lambda: timeline_pool.submit(fan_out_recipe, recipe_id)
+    )
+
+
+def schedule_backfill(follow):
+    user_id, author_id = follow.user_id, follow.following_id
+    transaction.on_commit(
+        lambda: timeline_pool.submit(backfill_timeline, user_id, author_id)
+    )
+
+
+def get_timeline_sources(user):
+    """(recipe id field, queryset) pairs merged into the user's timeline.
+
+    Entries are limited to the authors still followed: a fan-out batch
+    running during an unfollow may insert them after they were deleted.
+    """
+    following = Follow.objects.filter(user=user).values('following')
+    return (
+        ('recipe_id', TimelineEntry.objects.filter(
+            user=user, author__in=following,
+        )),
+        ('id', Recipe.objects.filter(
+            in_timelines=False, author__in=following,
+        )),
+    )